@@ -0,0 +1,89 @@
+"""Throughput of the API under concurrent clients with the sync and the async database mode.
+
+Run from the backend directory against a seeded database (see db_startup.py):
+
+    python -m benchmarks.concurrency --clients 50 --requests 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+PATHS = ["/api/subjects", "/api/teachers", "/api/questions", "/api/subjects/1/themes", "/api/users/1"]
+
+
+async def wait_for_server(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url + "/docs")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+
+    raise RuntimeError("Server did not start")
+
+
+async def run_client(client: httpx.AsyncClient, url: str, requests: int, offset: int, latencies: list):
+    for i in range(requests):
+        start = time.perf_counter()
+        response = await client.get(url + PATHS[(offset + i) % len(PATHS)])
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+async def run_load(url: str, clients: int, requests: int):
+    latencies = []
+    limits = httpx.Limits(max_connections=clients)
+
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(run_client(client, url, requests, i, latencies) for i in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def benchmark_mode(use_async: bool, args):
+    env = dict(os.environ, USE_ASYNC_DATABASE="1" if use_async else "0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        env=env
+    )
+    url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        asyncio.run(wait_for_server(url))
+        return asyncio.run(run_load(url, args.clients, args.requests))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    for name, use_async in (("sync", False), ("async", True)):
+        result = benchmark_mode(use_async, args)
+        print(f"{name:>5}: {result['throughput']:8.1f} req/s   "
+              f"p50 {result['p50']:8.1f} ms   p95 {result['p95']:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
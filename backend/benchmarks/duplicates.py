@@ -0,0 +1,111 @@
+"""Cost and recall of the near-duplicate detection on a generated question bank.
+
+Fills a scratch database with questions of random words, a share of them reworded copies of another
+question (a few words replaced, dropped or swapped), computes the signatures, then times the check of
+a single text against the bank and the cluster scan of the whole bank, and reports how many of the
+planted copies each of them finds. Run from the backend directory:
+
+    python -m benchmarks.duplicates --questions 100000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import database as _database
+import duplicates as _duplicates
+import models as _models
+import services as _services
+from benchmarks.scratch import scratch_engine
+
+VOCABULARY = 5000
+WORDS_PER_QUESTION = (8, 25)
+THEMES = 100
+
+
+def reword(words: list):
+    words = list(words)
+
+    for _ in range(max(1, len(words) // 10)):
+        position = random.randrange(len(words))
+        change = random.choice(("replace", "drop", "swap"))
+
+        if change == "replace":
+            words[position] = random.choice(words)
+        elif change == "drop" and len(words) > 2:
+            del words[position]
+        elif position + 1 < len(words):
+            words[position], words[position + 1] = words[position + 1], words[position]
+
+    return words
+
+
+def make_bank(questions: int, copy_rate: float):
+    """Question texts by id and the planted (original, copy) pairs."""
+    vocabulary = [f"w{i}" for i in range(VOCABULARY)]
+    texts, pairs = {}, []
+
+    for question_id in range(1, questions + 1):
+        if texts and random.random() < copy_rate:
+            original = random.randint(1, question_id - 1)
+            texts[question_id] = " ".join(reword(texts[original].split()))
+            pairs.append((original, question_id))
+        else:
+            texts[question_id] = " ".join(random.choices(vocabulary, k=random.randint(*WORDS_PER_QUESTION)))
+
+    return texts, pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=100000)
+    parser.add_argument("--copy-rate", type=float, default=0.01, help="share of questions that reword another")
+    parser.add_argument("--checks", type=int, default=200)
+    args = parser.parse_args()
+
+    with scratch_engine("duplicates.db") as engine:
+        texts, pairs = make_bank(args.questions, args.copy_rate)
+
+        with engine.begin() as connection:
+            connection.execute(_models.Theme.__table__.insert(), [
+                {"id": i, "name": f"Theme {i}", "description": ""} for i in range(1, THEMES + 1)
+            ])
+            connection.execute(_models.Question.__table__.insert(), [
+                {"id": question_id, "text": text, "answer": "a", "max_mark": 1, "theme_id": 1 + question_id % THEMES}
+                for question_id, text in texts.items()
+            ])
+
+            start = time.perf_counter()
+            _duplicates.index(connection, texts.items())
+            print(f"Signatures of {args.questions} questions in {time.perf_counter() - start:.1f} s")
+
+        db = _database.SessionLocal(bind=engine)
+
+        try:
+            latencies, found = [], 0
+            for original, copy in random.sample(pairs, min(args.checks, len(pairs))):
+                start = time.perf_counter()
+                candidates = asyncio.run(_services.find_duplicates(texts[copy], db, threshold=0.5))
+                latencies.append((time.perf_counter() - start) * 1000)
+                found += original in {candidate.question.id for candidate in candidates}
+
+            print(f"Check: median {statistics.median(latencies):.2f} ms, max {max(latencies):.2f} ms, "
+                  f"original found for {found} of {len(latencies)} copies at threshold 0.5")
+
+            start = time.perf_counter()
+            clusters = asyncio.run(_services.get_duplicate_clusters(db, threshold=0.5))
+            elapsed = time.perf_counter() - start
+
+            cluster_of = {question_id: i for i, cluster in enumerate(clusters) for question_id in cluster.question_ids}
+            joined = sum(original in cluster_of and cluster_of.get(original) == cluster_of.get(copy)
+                         for original, copy in pairs)
+            print(f"Scan: {len(clusters)} clusters in {elapsed:.1f} s, {joined} of {len(pairs)} planted copies "
+                  f"clustered with their original; a pairwise comparison would take "
+                  f"{args.questions * (args.questions - 1) // 2:,} comparisons")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Time to load a question set through the bulk import and through one create_question call per question.
+
+Writes a JSON Lines or CSV file of generated questions spread over the themes of one subject, imports it
+into a scratch database, then adds a sample of questions one at a time the way POST
+/api/questions/{theme_id} does (duplicate check, insert, commit) and extrapolates that to the full set.
+Run from the backend directory:
+
+    python -m benchmarks.importing --questions 100000
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import time
+
+import database as _database
+import models as _models
+import schemas as _schemas
+import services as _services
+from benchmarks.scratch import scratch_engine
+
+THEMES = 50
+VOCABULARY = 5000
+
+
+def write_file(path: str, format: str, questions: int):
+    vocabulary = [f"w{i}" for i in range(VOCABULARY)]
+    rows = (
+        {"subject": "Subject", "theme": f"Theme {i % THEMES}", "answer": "a; b", "max_mark": 2,
+         "text": f"{i} " + " ".join(random.choices(vocabulary, k=random.randint(8, 25)))}
+        for i in range(questions)
+    )
+
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        if format == "csv":
+            writer = csv.DictWriter(file, ["subject", "theme", "text", "answer", "max_mark"])
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            file.writelines(json.dumps(row) + "\n" for row in rows)
+
+
+async def create_one_by_one(db, admin, amount: int):
+    for i in range(amount):
+        question = _schemas.QuestionCreate(id=0, text=f"Single {i}", answer="a; b", max_mark=2)
+        theme_id = 1 + i % THEMES
+
+        if await _services.get_question_by_text(theme_id, question.text, db) is None:
+            await _services.create_question(admin, theme_id, question, db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=100000)
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    parser.add_argument("--sample", type=int, default=1000, help="questions created one at a time")
+    args = parser.parse_args()
+
+    with scratch_engine("import.db") as engine:
+        with engine.begin() as connection:
+            connection.execute(_models.Subject.__table__.insert(), [{"id": 1, "name": "Subject"}])
+            connection.execute(_models.Theme.__table__.insert(), [
+                {"id": i + 1, "name": f"Theme {i}", "description": "", "subject_id": 1} for i in range(THEMES)
+            ])
+
+        path = os.path.join(os.path.dirname(engine.url.database), f"questions.{args.format}")
+        write_file(path, args.format, args.questions)
+
+        db = _database.SessionLocal(bind=engine)
+        admin = _schemas.Principal(id=1, email="admin", name="admin", role_id=2, role="administrator", version=1)
+
+        try:
+            with open(path, encoding="utf-8-sig", newline="") as file:
+                start = time.perf_counter()
+                report = asyncio.run(_services.import_questions(file, args.format, db))
+                elapsed = time.perf_counter() - start
+
+            print(f"import: {report.imported} questions in {elapsed:.1f} s ({len(report.errors)} rejected), "
+                  f"{report.imported / elapsed:.0f} questions/s")
+
+            start = time.perf_counter()
+            asyncio.run(create_one_by_one(db, admin, args.sample))
+            elapsed = time.perf_counter() - start
+
+            print(f"one by one: {args.sample} questions in {elapsed:.1f} s, {args.sample / elapsed:.0f} questions/s, "
+                  f"{args.questions * elapsed / args.sample:.0f} s for {args.questions} (without HTTP and auth)")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
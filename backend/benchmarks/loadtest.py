@@ -0,0 +1,207 @@
+"""Exam-day load test: concurrent users logging in, browsing, taking a test and viewing their results.
+
+Starts the app from main.py with uvicorn against the database in the working directory, which
+should be seeded first (see db_startup.py; every generated user has the password "password").
+Each client signs in as its own user and repeats the scenario; throughput and p50/p95/p99 latency
+are reported per endpoint and written as JSON so runs can be compared. Run from the backend directory:
+
+    python db_startup.py --users 1000 --questions 100000
+    python -m benchmarks.loadtest --clients 50 --iterations 5 --output loadtest.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.concurrency import wait_for_server
+
+SEEDED_PASSWORD = "password"
+
+# settings of the server recorded with the results
+ENVIRONMENT = ("USE_ASYNC_DATABASE", "FAST_RESPONSES", "HASH_WORKERS", "TEST_POOL_SIZE")
+
+
+def percentile(values: list, share: float):
+    """Nearest-rank percentile of sorted values."""
+    return values[max(0, int(round(share * len(values))) - 1)]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        self.latencies.setdefault(name, []).append(elapsed)
+        if response.is_error:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+        return response
+
+    def summary(self, elapsed: float):
+        endpoints = {}
+
+        for name, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            endpoints[name] = {
+                "requests": len(latencies),
+                "errors": self.errors.get(name, 0),
+                "throughput": len(latencies) / elapsed,
+                "mean_ms": sum(latencies) / len(latencies) * 1000,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+            }
+
+        everything = sorted(latency for latencies in self.latencies.values() for latency in latencies)
+        total = {
+            "requests": len(everything),
+            "errors": sum(self.errors.values()),
+            "throughput": len(everything) / elapsed,
+            "p50_ms": percentile(everything, 0.50) * 1000,
+            "p95_ms": percentile(everything, 0.95) * 1000,
+            "p99_ms": percentile(everything, 0.99) * 1000,
+        }
+
+        return {"elapsed_s": elapsed, "total": total, "endpoints": endpoints}
+
+
+async def scenario(client: httpx.AsyncClient, recorder: Recorder, email: str, iterations: int):
+    response = await recorder.request(
+        client, "POST /api/token", "POST", "/api/token", data={"username": email, "password": SEEDED_PASSWORD}
+    )
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    user = (await recorder.request(client, "GET /api/users/me", "GET", "/api/users/me", headers=headers)).json()
+
+    for _ in range(iterations):
+        subjects = (await recorder.request(client, "GET /api/subjects", "GET", "/api/subjects")).json()["items"]
+        subject = random.choice([subject for subject in subjects if subject["themes"]])
+        await recorder.request(client, "GET /api/subjects/{id}", "GET", f"/api/subjects/{subject['id']}")
+        themes = (await recorder.request(
+            client, "GET /api/subjects/{id}/themes", "GET", f"/api/subjects/{subject['id']}/themes"
+        )).json()["items"]
+
+        theme_names = [theme["name"] for theme in random.sample(themes, min(5, len(themes)))]
+        test = (await recorder.request(
+            client, "GET /api/subjects/{id}/tests", "GET", f"/api/subjects/{subject['id']}/tests",
+            params={"theme_names": theme_names}, headers=headers
+        )).json()
+
+        answers = [
+            {"question_id": question["id"], "given_answer": random.choice(("right", "wrong"))}
+            for question in test["questions"]
+        ]
+        await recorder.request(
+            client, "POST /api/subjects/{id}/tests/{id}/answers", "POST",
+            f"/api/subjects/{subject['id']}/tests/{test['id']}/answers", json=answers, headers=headers
+        )
+
+        await recorder.request(
+            client, "GET /api/users/{id}/tests", "GET", f"/api/users/{user['id']}/tests", headers=headers
+        )
+
+
+async def run_load(url: str, args):
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.clients)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            scenario(client, recorder, f"user{i % args.users}@mail.ru", args.iterations) for i in range(args.clients)
+        ))
+        elapsed = time.perf_counter() - start
+
+    return recorder.summary(elapsed)
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(result: dict, baseline: dict):
+    print(f"Compared with revision {baseline['config'].get('revision') or 'unknown'} from {baseline['finished_at']}:")
+
+    for name, endpoint in {**result["endpoints"], "total": result["total"]}.items():
+        before = baseline["total"] if name == "total" else baseline["endpoints"].get(name)
+        if before is None:
+            continue
+
+        changes = "   ".join(
+            f"{key[:-3]} {(endpoint[key] - before[key]) / before[key] * 100:+7.1f}%"
+            for key in ("p50_ms", "p95_ms", "p99_ms")
+        )
+        print(f"{name:<45} {changes}")
+
+
+def start_server(port: int):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20, help="concurrent users")
+    parser.add_argument("--iterations", type=int, default=5, help="scenario repetitions per user after login")
+    parser.add_argument("--users", type=int, default=20, help="number of seeded users to sign in as")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--url", help="test an already running server instead of starting one")
+    parser.add_argument("--output", default="loadtest.json")
+    parser.add_argument("--compare", help="results file of an earlier run to compare latencies with")
+    args = parser.parse_args()
+
+    server = None if args.url else start_server(args.port)
+    url = args.url or f"http://127.0.0.1:{args.port}"
+
+    try:
+        asyncio.run(wait_for_server(url))
+        result = asyncio.run(run_load(url, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    result["config"] = {
+        "clients": args.clients,
+        "iterations": args.iterations,
+        "users": args.users,
+        "url": url,
+        "revision": revision(),
+        "environment": {name: os.environ[name] for name in ENVIRONMENT if name in os.environ},
+    }
+    result["finished_at"] = datetime.datetime.utcnow().isoformat()
+
+    with open(args.output, "w") as file:
+        json.dump(result, file, indent=2)
+
+    for name, endpoint in {**result["endpoints"], "total": result["total"]}.items():
+        print(f"{name:<45} {endpoint['requests']:6d} req {endpoint['errors']:4d} err "
+              f"{endpoint['throughput']:8.1f} req/s   p50 {endpoint['p50_ms']:8.1f} ms   "
+              f"p95 {endpoint['p95_ms']:8.1f} ms   p99 {endpoint['p99_ms']:8.1f} ms")
+
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            print_comparison(result, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
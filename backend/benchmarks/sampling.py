@@ -0,0 +1,73 @@
+"""Cost and accuracy of the weighted sampling of adaptive tests.
+
+For themes of growing size with random answer statistics, times building the theme's alias table and
+drawing the questions of a test for a student who has answered a share of them, then draws single
+questions many times and compares how often each came up with the probabilities weights() reports.
+Run from the backend directory:
+
+    python -m benchmarks.sampling --sizes 1000 10000 100000
+"""
+import argparse
+import collections
+import itertools
+import random
+import statistics
+import time
+
+import sampling as _sampling
+
+
+def make_theme(size: int, answered: float):
+    """Filled QuestionWeights with one theme of ``size`` questions and a student's scores for a share of them."""
+    weights = _sampling.QuestionWeights()
+    stats = []
+
+    for question_id in range(1, size + 1):
+        attempts = random.randint(0, 50)
+        stats.append((question_id, random.betavariate(2, 2) * attempts, attempts))
+
+    weights.load([(question_id, 1) for question_id in range(1, size + 1)], stats)
+    scores = {question_id: random.choice((0, 0.5, 1)) for question_id in random.sample(range(1, size + 1),
+                                                                                       int(size * answered))}
+
+    return weights, scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--answered", type=float, default=0.01, help="share of the theme the student answered")
+    parser.add_argument("--tests", type=int, default=1000)
+    parser.add_argument("--draws", type=int, default=200000, help="single draws for the distribution check")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        weights, scores = make_theme(size, args.answered)
+
+        start = time.perf_counter()
+        expected = {question_id: weight for (question_id, *_, weight) in weights.weights(1, scores)}
+        built = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(args.tests):
+            start = time.perf_counter()
+            weights.sample(1, 20, scores)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        # the questions with the most expected draws, each compared alone, the rest as one group
+        total = sum(expected.values())
+        sampler = weights.sampler(1, scores)
+        draws = (sampler.draw() for _ in itertools.count())
+        counts = collections.Counter(itertools.islice(filter(None, draws), args.draws))
+        top = sorted(expected, key=expected.get, reverse=True)[:50]
+        groups = [(counts[question_id], expected[question_id] / total) for question_id in top]
+        groups.append((args.draws - sum(count for count, _ in groups), 1 - sum(share for _, share in groups)))
+        chi_square = sum((count - share * args.draws) ** 2 / (share * args.draws) for count, share in groups)
+
+        print(f"{size} questions: table built in {built * 1000:.0f} ms, 20-question test in "
+              f"{statistics.median(latencies):.3f} ms median, {max(latencies):.3f} ms max; "
+              f"chi-square of the draws {chi_square:.1f} over {len(groups) - 1} degrees of freedom")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""A scratch database for the benchmarks and the query checks."""
+import contextlib
+import os
+import tempfile
+
+import sqlalchemy as _sql
+
+import database as _database
+
+
+@contextlib.contextmanager
+def scratch_engine(name: str = "scratch.db"):
+    """An engine on a new SQLite database with every table. The database is created in a temporary directory,
+    which is deleted with everything in it on exit.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        engine = _sql.create_engine(
+            f"sqlite:///{os.path.join(directory, name)}", connect_args={"check_same_thread": False}
+        )
+        _database.Base.metadata.create_all(bind=engine)
+
+        try:
+            yield engine
+        finally:
+            engine.dispose()
@@ -0,0 +1,102 @@
+"""Latency of the question search against a LIKE scan of questions.text.
+
+Fills a scratch database with questions made of random words (the FTS index is kept up to date by
+its triggers while inserting) and times search_questions for a few queries next to the LIKE filter
+an ad-hoc search would use. Run from the backend directory:
+
+    python -m benchmarks.search --questions 1000000
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import statistics
+import time
+
+import sqlalchemy as _sql
+
+import database as _database
+import models as _models
+import services as _services
+from benchmarks.scratch import scratch_engine
+
+VOCABULARY = 20000
+WORDS_PER_QUESTION = 12
+THEMES = 100
+
+
+def make_words(amount: int):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return sorted({"".join(random.choices(letters, k=random.randint(4, 10))) for _ in range(amount)})
+
+
+def seed(engine, questions: int, words: list):
+    # Zipf-like word frequencies, so some words are common and most are rare
+    weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+
+    with engine.begin() as connection:
+        connection.execute(_models.Theme.__table__.insert(), [
+            {"id": i, "name": f"Theme {i}", "description": " ".join(random.sample(words, 5))}
+            for i in range(1, THEMES + 1)
+        ])
+
+        for start in range(0, questions, 10000):
+            connection.execute(_models.Question.__table__.insert(), [
+                {
+                    "text": " ".join(random.choices(words, cum_weights=weights, k=WORDS_PER_QUESTION)),
+                    "answer": "a", "max_mark": 1, "theme_id": 1 + i % THEMES,
+                }
+                for i in range(start, min(start + 10000, questions))
+            ])
+
+
+def timed(function, repeat: int):
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with scratch_engine("search.db") as engine:
+        words = make_words(VOCABULARY)
+
+        start = time.perf_counter()
+        seed(engine, args.questions, words)
+        print(f"Inserted {args.questions} questions with the search index in {time.perf_counter() - start:.1f} s")
+
+        db = _database.SessionLocal(bind=engine)
+        queries = {
+            "common word": words[0],
+            "rare word": words[-1],
+            "prefix": words[len(words) // 2][:3],
+            "two words": f"{words[1]} {words[100]}",
+        }
+
+        try:
+            for name, query in queries.items():
+                search_ms, page = timed(
+                    lambda: asyncio.run(_services.search_questions(query, db, limit=50)), args.repeat
+                )
+                like = _sql.select(_models.Question.id).filter(
+                    *(_models.Question.text.like(f"%{word}%") for word in query.split())
+                ).limit(50)
+                like_ms, _ = timed(lambda: db.execute(like).all(), args.repeat)
+
+                results = f"{len(page.items)} results" + (", truncated" if page.truncated else "")
+                print(f"{name:>12} {query!r:24} search {search_ms:8.2f} ms ({results})   LIKE {like_ms:8.2f} ms")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Cost of serializing a large question listing with the default and the FAST_RESPONSES path.
+
+Fills a scratch database with questions and times building and encoding one page of all of them:
+the default path loads ORM rows, converts them with Question.from_orm and goes through FastAPI's
+response validation and jsonable_encoder; the fast path reads plain rows and encodes them directly.
+Run from the backend directory:
+
+    python -m benchmarks.serialization --questions 100000
+"""
+import argparse
+import asyncio
+import time
+
+import fastapi.responses as _responses
+import fastapi.routing as _routing
+
+import database as _database
+import main as _main
+import models as _models
+import serialization as _serialization
+import services as _services
+from benchmarks.scratch import scratch_engine
+
+
+def seed(engine, questions: int, themes: int = 100):
+    with engine.begin() as connection:
+        connection.execute(_models.Subject.__table__.insert(), [{"id": 1, "name": "Subject"}])
+        connection.execute(_models.Theme.__table__.insert(), [
+            {"id": i, "name": f"Theme {i}", "description": f"Description of theme {i}", "subject_id": 1}
+            for i in range(1, themes + 1)
+        ])
+        connection.execute(_models.Question.__table__.insert(), [
+            {"text": f"Question number {i}?", "answer": "a; b", "max_mark": 1 + i % 3, "theme_id": 1 + i % themes}
+            for i in range(questions)
+        ])
+
+
+async def default_path(db, limit: int):
+    page = await _services.get_questions(db, None, limit)
+    field = next(route for route in _main.app.routes if route.path == "/api/questions").response_field
+    content = await _routing.serialize_response(field=field, response_content=page)
+
+    return _responses.JSONResponse(content).body
+
+
+async def fast_path(db, limit: int):
+    return _serialization.response(await _services.get_question_rows(db, None, limit)).body
+
+
+def timed(path, db, limit: int, repeat: int):
+    best, body = None, None
+
+    for _ in range(repeat):
+        db.expunge_all()
+        start = time.perf_counter()
+        body = asyncio.run(path(db, limit))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with scratch_engine("serialization.db") as engine:
+        seed(engine, args.questions)
+
+        db = _database.SessionLocal(bind=engine)
+        try:
+            results = {name: timed(path, db, args.questions, args.repeat)
+                       for name, path in (("default", default_path), ("fast", fast_path))}
+        finally:
+            db.close()
+
+        for name, (elapsed, body) in results.items():
+            print(f"{name:>7}: {elapsed * 1000:8.0f} ms for {args.questions} questions, "
+                  f"{len(body)} bytes ({_serialization.ENCODER})")
+
+
+if __name__ == "__main__":
+    main()
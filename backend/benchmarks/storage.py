@@ -0,0 +1,147 @@
+"""Write throughput and read latency under mixed load for each SQLite storage profile.
+
+For every profile in database.SQLITE_PROFILES a scratch database is filled with questions and tests,
+then writer processes submit answers in small transactions, as answer submission does, while reader
+processes look questions up by id. Each process opens its own connections with the profile's
+PRAGMAs. Run from the backend directory:
+
+    python -m benchmarks.storage --writers 2 --readers 4 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import sqlalchemy as _sql
+
+import database as _database
+import models as _models
+
+QUESTIONS = 10000
+TESTS = 1000
+ANSWERS_PER_SUBMIT = 20
+
+
+def connect(path: str, profile: str):
+    engine = _sql.create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    _database.set_sqlite_pragmas(engine, _database.SQLITE_PROFILES[profile])
+    return engine
+
+
+def seed(path: str, profile: str):
+    engine = connect(path, profile)
+    _database.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        connection.execute(_models.Theme.__table__.insert(), [{"id": 1, "name": "Theme", "description": ""}])
+        connection.execute(_models.Question.__table__.insert(), [
+            {"id": i, "text": f"Question {i}", "answer": "a; b", "max_mark": 2, "theme_id": 1}
+            for i in range(1, QUESTIONS + 1)
+        ])
+        connection.execute(_models.Test.__table__.insert(), [{"id": i} for i in range(1, TESTS + 1)])
+
+    engine.dispose()
+
+
+def write(path: str, profile: str, start: float, deadline: float, results):
+    engine = connect(path, profile)
+    time.sleep(max(0.0, start - time.time()))
+    transactions, errors = 0, 0
+
+    while time.time() < deadline:
+        test_id = random.randint(1, TESTS)
+        answers = [
+            {"test_id": test_id, "question_id": random.randint(1, QUESTIONS), "given_answer": "a", "mark": 1}
+            for _ in range(ANSWERS_PER_SUBMIT)
+        ]
+
+        try:
+            with engine.begin() as connection:
+                connection.execute(_models.Answer.__table__.insert().prefix_with("OR REPLACE"), answers)
+            transactions += 1
+        except _sql.exc.OperationalError:
+            errors += 1
+
+    results.put(("write", transactions, errors, []))
+
+
+def read(path: str, profile: str, start: float, deadline: float, results):
+    engine = connect(path, profile)
+    time.sleep(max(0.0, start - time.time()))
+    statement = _sql.select(_models.Question).filter(_models.Question.id == _sql.bindparam("id"))
+    latencies, errors = [], 0
+
+    with engine.connect() as connection:
+        while time.time() < deadline:
+            began = time.perf_counter()
+
+            try:
+                connection.execute(statement, {"id": random.randint(1, QUESTIONS)}).all()
+                latencies.append(time.perf_counter() - began)
+            except _sql.exc.OperationalError:
+                errors += 1
+
+    results.put(("read", len(latencies), errors, latencies))
+
+
+def benchmark_profile(profile: str, path: str, args):
+    seed(path, profile)
+
+    results = multiprocessing.Queue()
+    start = time.time() + 2
+    deadline = start + args.seconds
+    workers = [multiprocessing.Process(target=write, args=(path, profile, start, deadline, results))
+               for _ in range(args.writers)]
+    workers += [multiprocessing.Process(target=read, args=(path, profile, start, deadline, results))
+                for _ in range(args.readers)]
+
+    for worker in workers:
+        worker.start()
+
+    totals = {"write": [0, 0], "read": [0, 0]}
+    latencies = []
+
+    for _ in workers:
+        kind, count, errors, worker_latencies = results.get()
+        totals[kind][0] += count
+        totals[kind][1] += errors
+        latencies.extend(worker_latencies)
+
+    for worker in workers:
+        worker.join()
+
+    latencies.sort()
+    return {
+        "writes": totals["write"][0] / args.seconds,
+        "write_errors": totals["write"][1],
+        "reads": totals["read"][0] / args.seconds,
+        "read_errors": totals["read"][1],
+        "read_p50": statistics.median(latencies) * 1000 if latencies else float("nan"),
+        "read_p95": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else float("nan"),
+        "read_p99": latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--directory", default=".", help="where to create the scratch databases")
+    args = parser.parse_args()
+
+    for profile in _database.SQLITE_PROFILES:
+        with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+            result = benchmark_profile(profile, os.path.join(directory, "storage.db"), args)
+
+        print(f"{profile:>8}: {result['writes']:8.1f} submits/s ({result['write_errors']} failed)   "
+              f"{result['reads']:8.1f} reads/s ({result['read_errors']} failed)   "
+              f"read p50 {result['read_p50']:6.2f} ms   p95 {result['read_p95']:6.2f} ms   "
+              f"p99 {result['read_p99']:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
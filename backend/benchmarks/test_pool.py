@@ -0,0 +1,122 @@
+"""Latency of starting a test with and without the pool of ready-made tests.
+
+Fills a scratch database with a question bank spread over the themes of one subject, then starts a test
+for each of a class of students, first generating every test on request and then from a pool of the
+default size filled beforehand. Students start at a steady rate, so the pool has to keep up with them by
+refilling while tests are taken; --rate 0 starts them back to back. Run from the backend directory:
+
+    python -m benchmarks.test_pool --questions 10000 100000 --students 600 --rate 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import sqlalchemy as _sql
+
+import database as _database
+import models as _models
+import schemas as _schemas
+import services as _services
+import test_pool as _test_pool
+from benchmarks.loadtest import percentile
+from benchmarks.scratch import scratch_engine
+
+THEMES = 5
+
+
+def make_bank(engine, questions: int):
+    with engine.begin() as connection:
+        connection.execute(_models.Subject.__table__.insert(), [{"id": 1, "name": "Subject"}])
+        connection.execute(_models.Theme.__table__.insert(), [
+            {"id": i, "name": f"Theme {i}", "description": "", "subject_id": 1} for i in range(1, THEMES + 1)
+        ])
+        connection.execute(_models.Question.__table__.insert(), [
+            {"id": i, "text": f"Question {i}", "answer": "a", "max_mark": 1, "theme_id": 1 + i % THEMES}
+            for i in range(1, questions + 1)
+        ])
+
+
+def pool_session(engine, function):
+    def run(*args):
+        db = _database.SessionLocal(bind=engine)
+        try:
+            return asyncio.run(function(*args, db))
+        finally:
+            db.close()
+
+    return run
+
+
+class CountingPool(_test_pool.TestPool):
+    taken = 0
+
+    def take(self, key):
+        test_id = super().take(key)
+        self.taken += test_id is not None
+        return test_id
+
+
+async def start_tests(db, students: int, theme_names: list, rate: float):
+    latencies = []
+    began = time.perf_counter()
+
+    for student in range(1, students + 1):
+        if rate:
+            await asyncio.sleep(max(0.0, began + student / rate - time.perf_counter()))
+
+        user = _schemas.Principal(id=student, email=f"{student}", name="", role_id=1, role="user", version=1)
+        start = time.perf_counter()
+        await _services.generate_test(1, theme_names, db, user)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--students", type=int, default=600)
+    parser.add_argument("--rate", type=float, default=20, help="test starts per second, 0 for back to back")
+    args = parser.parse_args()
+
+    theme_names = [f"Theme {i}" for i in range(1, THEMES + 1)]
+
+    for questions in args.questions:
+        with scratch_engine("pool.db") as engine:
+            make_bank(engine, questions)
+            db = _database.SessionLocal(bind=engine)
+            pool = CountingPool(
+                pool_session(engine, _services._generate_pooled_tests),
+                pool_session(engine, _services._discard_pooled_tests),
+            )
+
+            try:
+                _services._questions_by_theme = _services._question_index.QuestionIndex()
+                _services.pooled_tests = _test_pool.TestPool(None, None, size=0)
+                on_request = asyncio.run(start_tests(db, args.students, theme_names, args.rate))
+
+                _services.pooled_tests = pool
+                pool.start()
+                pool.want((1, tuple(theme_names)))
+
+                unclaimed = _sql.select(_sql.func.count()).select_from(_models.Test).filter(
+                    _models.Test.pool_owner == pool.owner
+                )
+                while db.execute(unclaimed).scalar() < pool.size:
+                    time.sleep(0.1)
+
+                pooled = asyncio.run(start_tests(db, args.students, theme_names, args.rate))
+            finally:
+                pool.stop()
+                db.close()
+
+            for name, latencies in (("on request", on_request), ("with the pool", pooled)):
+                print(f"{questions} questions, {name}: median {statistics.median(latencies):.2f} ms, "
+                      f"p95 {percentile(latencies, 0.95):.2f} ms, max {latencies[-1]:.2f} ms")
+
+            print(f"{questions} questions: {pool.taken} of {args.students} tests came from the pool")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import collections as _collections
+import time as _time
+
+
+class TTLCache:
+    """Bounded in-process cache whose entries expire ``ttl`` seconds after being set.
+
+    ``generation`` changes on every clear(), so a caller that loaded a value while the cache was being
+    cleared can tell that the value may already be stale. ``cleared_at`` is the monotonic time of the last clear().
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.generation = 0
+        self.cleared_at = float('-inf')
+        self._data = _collections.OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+
+        if item is None:
+            return default
+
+        value, expires = item
+        if expires < _time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, _time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self.generation += 1
+        self.cleared_at = _time.monotonic()
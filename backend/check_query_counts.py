@@ -0,0 +1,161 @@
+"""Checks that no endpoint runs more queries as the data it returns grows.
+
+Seeds two scratch databases, one with a handful of rows per relationship and one with many, calls
+every read endpoint against each through the test client and counts the statements it executes.
+An endpoint whose count differs between the two is lazy loading per row and fails the check.
+Run from the backend directory:
+
+    python check_query_counts.py
+"""
+import asyncio
+import sys
+
+import fastapi.testclient as _testclient
+import sqlalchemy as _sql
+import sqlalchemy.event as _event
+
+import database as _database
+import loading as _loading
+import main as _main
+import models as _models
+import question_index as _question_index
+import sampling as _sampling
+import services as _services
+from benchmarks.scratch import scratch_engine
+
+SMALL_SCALE = 2
+LARGE_SCALE = 12
+
+
+def _seed(db, scale: int):
+    db.add_all([_models.Role(name="user"), _models.Role(name="administrator")])
+    db.add_all([_models.User(email=f"user{i}@mail.ru", name=f"User {i}", hashed_password="x") for i in range(scale)])
+
+    subject = _models.Subject(name="Subject")
+    themes = [_models.Theme(name=f"Theme {i}", description="", subject=subject) for i in range(scale)]
+    questions = [
+        _models.Question(text=f"Question {i}", answer="a; b", max_mark=2, theme=themes[i % scale])
+        for i in range(scale * scale)
+    ]
+    teachers = [_models.Teacher(name=f"Teacher {i}", phone_number=str(i), themes=themes) for i in range(scale)]
+    db.add_all([subject, *themes, *questions, *teachers])
+    db.flush()
+
+    user = db.execute(_sql.select(_models.User).filter_by(email="user0@mail.ru")).scalar_one()
+    for i in range(scale):
+        test = _models.Test(user=user, questions=questions[i::scale])
+        test.answers = [
+            _models.Answer(question=question, given_answer="a", mark=question.max_mark // 2)
+            for question in test.questions
+        ]
+        db.add(test)
+
+    db.add_all([
+        _models.UserThemeStats(user_id=user.id, theme_id=theme.id, mark_sum=i, attempts=scale)
+        for i, theme in enumerate(themes)
+    ])
+    db.add_all([
+        _models.QuestionStats(question_id=question.id, mark_sum=i % 3, attempts=scale)
+        for i, question in enumerate(questions)
+    ])
+    db.commit()
+
+    user = db.execute(_sql.select(_models.User).options(*_loading.PRINCIPAL).filter_by(id=user.id)).scalar_one()
+    return asyncio.run(_services.create_token(user))["access_token"]
+
+
+def _requests(db):
+    user = db.execute(_sql.select(_models.User.id).filter_by(email="user0@mail.ru")).scalar_one()
+    test = db.execute(_sql.select(_models.Test.id).filter_by(user_id=user).order_by(_models.Test.id)).scalars().first()
+    theme_names = db.execute(_sql.select(_models.Theme.name)).scalars().all()
+    questions = db.execute(_sql.select(_models.Question.id).order_by(_models.Question.id)).scalars().all()
+    test_questions = db.execute(
+        _sql.select(_models.test_question_association_table.c.question_id).filter_by(test_id=test)
+    ).scalars().all()
+
+    return [
+        ("GET", "/api/users?limit=500", None),
+        ("GET", "/api/users/me", None),
+        ("GET", f"/api/users/{user}", None),
+        ("GET", f"/api/users/{user}/tests?limit=500", None),
+        ("GET", "/api/teachers?limit=500", None),
+        ("GET", "/api/teachers/1", None),
+        ("GET", "/api/subjects?limit=500", None),
+        ("GET", "/api/subjects/1", None),
+        ("GET", "/api/subjects/1/themes?limit=500", None),
+        ("GET", "/api/subjects/1/themes/1", None),
+        ("GET", "/api/questions?limit=500", None),
+        ("GET", f"/api/questions/{questions[0]}", None),
+        ("GET", f"/api/subjects/1/tests/{test}", None),
+        ("GET", "/api/subjects/1/tests?" + "&".join(f"theme_names={name}" for name in theme_names), None),
+        ("GET", "/api/subjects/1/tests?adaptive=true&" + "&".join(f"theme_names={name}" for name in theme_names),
+         None),
+        ("POST", f"/api/subjects/1/tests/{test}/answers",
+         [{"question_id": question, "given_answer": "b"} for question in test_questions]),
+    ]
+
+
+def count_queries(scale: int):
+    with scratch_engine("counts.db") as engine:
+        def get_db():
+            db = _database.SessionLocal(bind=engine)
+            try:
+                yield db
+            finally:
+                db.close()
+
+        _main.app.dependency_overrides[_services.get_db] = get_db
+        _main.app.dependency_overrides[_services.get_read_db] = get_db
+        _services._principal_versions.clear()
+        _services._questions_by_theme = _question_index.QuestionIndex()
+        _services._question_weights = _sampling.QuestionWeights()
+        _services._answer_keys.clear()
+
+        db = _database.SessionLocal(bind=engine)
+        try:
+            token = _seed(db, scale)
+            requests = _requests(db)
+        finally:
+            db.close()
+
+        statements = []
+        _event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+        client = _testclient.TestClient(_main.app)
+        headers = {"Authorization": f"Bearer {token}"}
+        counts = {}
+
+        for method, url, body in requests:
+            _services.invalidate_catalog()
+            statements.clear()
+
+            response = client.request(method, url, json=body, headers=headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"{method} {url} answered {response.status_code}: {response.text}")
+
+            name = f"{method} {url.split('?')[0]}" + (" (adaptive)" if "adaptive=true" in url else "")
+            counts[name] = len(statements)
+
+        _main.app.dependency_overrides.clear()
+        return counts
+
+
+def main():
+    small = count_queries(SMALL_SCALE)
+    large = count_queries(LARGE_SCALE)
+    failures = 0
+
+    for endpoint, count in small.items():
+        grows = large[endpoint] != count
+        failures += grows
+
+        print(f"{'FAIL' if grows else 'ok  '} {endpoint}: {count} queries at scale {SMALL_SCALE}, "
+              f"{large[endpoint]} at scale {LARGE_SCALE}")
+
+    print(f"{len(small)} endpoints checked, {failures} with a query count that grows with the data")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
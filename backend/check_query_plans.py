@@ -0,0 +1,156 @@
+"""Checks that every filtered query the services run is answered through an index.
+
+Runs the service functions against a scratch database, records each statement they execute and
+asks SQLite for its EXPLAIN QUERY PLAN. A statement with a WHERE clause or a join fails the check if
+its plan scans a table without an index. Queries that list a whole table have nothing to look up
+and are not checked. Run from the backend directory:
+
+    python check_query_plans.py
+"""
+import asyncio
+import sys
+
+import sqlalchemy.event as _event
+
+import database as _database
+import models as _models
+import schemas as _schemas
+import services as _services
+from benchmarks.scratch import scratch_engine
+
+
+def _record_statements(engine):
+    statements = {}
+
+    @_event.listens_for(engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.setdefault(statement, parameters[0] if executemany else parameters)
+
+    return statements
+
+
+async def _exercise_services(db):
+    db.add_all([_models.Role(name="user"), _models.Role(name="administrator")])
+    db.commit()
+
+    user = _schemas.UserCreate(email="user@mail.ru", name="user", hashed_password="x")
+    user = await _services.create_user(user, db)
+    admin = _schemas.Principal(id=user.id, email=user.email, name=user.name, role_id=2, role="administrator", version=1)
+
+    subject = await _services.create_subject(admin, _schemas.SubjectCreate(id=0, name="Subject"), db)
+    themes = [
+        await _services.create_theme(subject.id, db, _schemas.ThemeCreate(id=0, name=name, description=""), admin)
+        for name in ("Theme 0", "Theme 1")
+    ]
+    questions = [
+        await _services.create_question(
+            admin, themes[i % 2].id, _schemas.QuestionCreate(id=0, text=f"Question {i}", max_mark=2, answer="a; b"), db
+        )
+        for i in range(10)
+    ]
+    teacher = await _services.create_teacher(
+        admin, _schemas.TeacherCreate(name="Teacher", phone_number="1", theme_ids=[theme.id for theme in themes]), db
+    )
+
+    await _services.get_user_by_email(user.email, db)
+    await _services.authenticate_user(user.email, "x", db)
+    await _services._token_version(user.id, db)
+    await _services.get_user(user.id, db)
+    await _services.get_teacher_by_phone(teacher.phone_number, db)
+    await _services.get_teacher(teacher.id, db)
+    await _services.get_subject_by_name(subject.name, db)
+    await _services.get_subject(subject.id, db)
+    await _services.get_themes(subject.id, db)
+    await _services.get_theme_by_name(subject.id, themes[0].name, db)
+    await _services.get_theme(subject.id, themes[0].id, db)
+    await _services.get_question_by_text(themes[0].id, questions[0].text, db)
+    await _services.get_question(questions[0].id, db)
+    await _services.get_question_rows(db, questions[0].id, theme_id=themes[0].id)
+    await _services.get_teacher_rows(db, theme_id=themes[0].id)
+    await _services.search_questions("quest", db, theme_id=themes[0].id)
+    await _services.find_duplicates(questions[2].text, db)
+    await _services.get_duplicate_clusters(db)
+
+    test = await _services.generate_test(subject.id, [theme.name for theme in themes], db, admin)
+    await _services.generate_test(subject.id, [theme.name for theme in themes], db, admin, adaptive=True)
+    pooled = await _services._generate_pooled_tests("plans", (subject.id, tuple(theme.name for theme in themes)), 2, db)
+    await _services._discard_pooled_tests("plans", pooled, db)
+    answer = _schemas.AnswerCreate(id=0, given_answer="a")
+    await _services.answer_exists(test.id, test.questions[0].id, db)
+    await _services.create_answer(test.id, test.questions[0].id, answer, db)
+    await _services.update_answer(test.id, test.questions[0].id, answer, db)
+    answers = [_schemas.AnswerSubmit(question_id=question.id, given_answer="b") for question in test.questions]
+    await _services.submit_answers(test.id, answers, db, admin)
+    await _services.get_test(test.id, db, admin)
+    await _services.get_test_answers(db, admin)
+    await _services.get_worst_themes(user.id, db)
+    await _services.get_teacher_recommendations(user.id, db)
+    await _services.get_question_weights(subject.id, themes[0].id, db, user.id)
+
+    await _services.update_question(questions[0].id, _schemas.QuestionCreate(id=0, text="New", max_mark=1, answer="a"),
+                                    db, admin)
+    await _services.update_theme(subject.id, themes[0].id, _schemas.ThemeCreate(id=0, name="New", description=""),
+                                 db, admin)
+    await _services.update_teacher(teacher.id, admin, db, _schemas.TeacherCreate(name="New", phone_number="2",
+                                                                                  theme_ids=[themes[0].id]))
+    await _services.update_subject(subject.id, db, admin, _schemas.SubjectCreate(id=0, name="New"))
+    await _services.update_user(user.id, _schemas.UserCreate(email=user.email, name="New", hashed_password="y"),
+                                admin, db)
+
+    await _services.delete_question(questions[1].id, db, admin)
+    await _services.delete_teacher(teacher.id, admin, db)
+    await _services.delete_theme(subject.id, themes[1].id, db, admin)
+    await _services.delete_user(user.id, admin, db)
+
+
+def _is_lookup(statement: str):
+    words = statement.upper().split()
+    return "WHERE" in words or "JOIN" in words
+
+
+def check(engine, statements: dict):
+    failures = []
+
+    with engine.connect() as connection:
+        for statement, parameters in statements.items():
+            if not _is_lookup(statement):
+                continue
+
+            plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+            # reading the rows a subquery produced is not a table scan; the subquery's own plan is checked
+            subqueries = {row[-1].split()[1] for row in plan if row[-1].startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+            # nor is the single row of a SELECT without FROM
+            scans = [row[-1] for row in plan if row[-1].startswith("SCAN ") and " USING " not in row[-1]
+                     and " VIRTUAL TABLE INDEX " not in row[-1] and row[-1].split()[1] not in subqueries
+                     and row[-1] != "SCAN CONSTANT ROW"]
+
+            if scans:
+                failures.append((statement, scans))
+
+    return failures
+
+
+def main():
+    with scratch_engine("plans.db") as engine:
+        statements = _record_statements(engine)
+
+        db = _database.SessionLocal(bind=engine)
+        try:
+            asyncio.run(_exercise_services(db))
+        finally:
+            db.close()
+
+        failures = check(engine, statements)
+
+        for statement, scans in failures:
+            print(" ".join(statement.split()))
+            print("    " + "; ".join(scans))
+
+        print(f"{len(statements)} statements checked, {len(failures)} full table scans")
+
+        return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
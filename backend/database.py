@@ -1,11 +1,127 @@
+import os as _os
+
 import sqlalchemy as _sql
+import sqlalchemy.event as _event
+import sqlalchemy.ext.asyncio as _asyncio
 import sqlalchemy.ext.declarative as _declarative
 import sqlalchemy.orm as _orm
+import sqlalchemy.pool as _pool
+
+DATABASE_URL = _os.environ.get("DATABASE_URL", "sqlite:///./database.db")
+ASYNC_DATABASE_URL = _os.environ.get("ASYNC_DATABASE_URL", DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1))
+
+# Set REPLICA_DATABASE_URL to serve the read-only endpoints from a replica of the database
+REPLICA_DATABASE_URL = _os.environ.get("REPLICA_DATABASE_URL")
+ASYNC_REPLICA_DATABASE_URL = _os.environ.get(
+    "ASYNC_REPLICA_DATABASE_URL",
+    REPLICA_DATABASE_URL and REPLICA_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+)
+
+# how far the replica may be behind the primary, in seconds; responses read from it are not cached for that long
+# after a change. The SQLite replication stand-in lags by up to its interval
+REPLICA_MAX_LAG = float(_os.environ.get("REPLICA_MAX_LAG", _os.environ.get("SQLITE_REPLICATION_INTERVAL", 0)))
+
+# Set USE_ASYNC_DATABASE=1 to serve requests through the aiosqlite driver so queries don't block the event loop
+USE_ASYNC_DATABASE = _os.environ.get("USE_ASYNC_DATABASE", "0") == "1"
+
+# PRAGMAs run on every new SQLite connection. "default" leaves SQLite's own settings; "tuned" lets readers
+# run next to a writer (WAL), syncs only at checkpoints and keeps more of the file in memory
+SQLITE_PROFILES = {
+    "default": {},
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+    },
+}
+
+# SQLITE_PROFILE picks a profile; SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, ... override single PRAGMAs of it
+SQLITE_PROFILE = _os.environ.get("SQLITE_PROFILE", "default")
+SQLITE_PRAGMAS = {
+    **SQLITE_PROFILES[SQLITE_PROFILE],
+    **{
+        name: _os.environ[f"SQLITE_{name.upper()}"]
+        for name in SQLITE_PROFILES["tuned"] if f"SQLITE_{name.upper()}" in _os.environ
+    },
+}
+
+# Set DATABASE_POOL_SIZE to keep that many connections open instead of opening one per session, which also
+# keeps SQLite's page cache and memory map warm between requests
+DATABASE_POOL_SIZE = _os.environ.get("DATABASE_POOL_SIZE")
+DATABASE_MAX_OVERFLOW = int(_os.environ.get("DATABASE_MAX_OVERFLOW", 10))
+DATABASE_POOL_TIMEOUT = float(_os.environ.get("DATABASE_POOL_TIMEOUT", 30))
+
+
+def set_sqlite_pragmas(engine, pragmas: dict):
+    """Runs ``pragmas`` on every connection ``engine`` (a sync Engine) opens."""
+    @_event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+        cursor.close()
+
+
+def _pool_options(queue_pool):
+    options = {}
 
-DATABASE_URL = "sqlite:///./database.db"
+    if DATABASE_POOL_SIZE is not None:
+        options.update(
+            poolclass=queue_pool,
+            pool_size=int(DATABASE_POOL_SIZE),
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout=DATABASE_POOL_TIMEOUT,
+        )
 
-engine = _sql.create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    return options
+
+
+def _sqlite_pragmas(read_only: bool):
+    # a replica only changes through replication, so its connections refuse writes
+    return {**SQLITE_PRAGMAS, "query_only": "ON"} if read_only else SQLITE_PRAGMAS
+
+
+def _create_engine(url: str, read_only: bool = False):
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    engine = _sql.create_engine(url, connect_args=connect_args, **_pool_options(_pool.QueuePool))
+
+    if url.startswith("sqlite"):
+        set_sqlite_pragmas(engine, _sqlite_pragmas(read_only))
+
+    return engine
+
+
+def _create_async_engine(url: str, read_only: bool = False):
+    engine = _asyncio.create_async_engine(url, **_pool_options(_pool.AsyncAdaptedQueuePool))
+
+    if url.startswith("sqlite"):
+        set_sqlite_pragmas(engine.sync_engine, _sqlite_pragmas(read_only))
+
+    return engine
+
+
+engine = _create_engine(DATABASE_URL)
+replica_engine = engine if REPLICA_DATABASE_URL is None else _create_engine(REPLICA_DATABASE_URL, read_only=True)
 
 SessionLocal = _orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReplicaSessionLocal = _orm.sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+
+if USE_ASYNC_DATABASE:
+    async_engine = _create_async_engine(ASYNC_DATABASE_URL)
+    async_replica_engine = async_engine if REPLICA_DATABASE_URL is None \
+        else _create_async_engine(ASYNC_REPLICA_DATABASE_URL, read_only=True)
+
+    AsyncSessionLocal = _orm.sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=_asyncio.AsyncSession
+    )
+    AsyncReplicaSessionLocal = _orm.sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=async_replica_engine,
+        class_=_asyncio.AsyncSession
+    )
 
 Base = _declarative.declarative_base()
@@ -1,14 +1,28 @@
-from services import get_db, create_database, generate_test, create_answer
+"""Recreates the database at DATABASE_URL (database.db by default) filled with generated data.
+
+Every table is written with batched multi-row inserts inside one transaction, and tests and answers
+are generated directly instead of through the services, so production-sized datasets can be built:
+
+    python db_startup.py --users 100000 --questions 1000000 --tests 1000000
+"""
+from services import get_sync_db, create_database, get_amounts, rebuild_theme_stats, rebuild_question_stats
+import database as _database
 import models as _models
-import passlib.hash as _hash
+from hashing import hash_passwords
+from grading import AnswerKey
+from question_index import QuestionIndex
+import duplicates
 from faker import Faker
+from sqlalchemy.engine import make_url
+import argparse
+import array
+import datetime
+import itertools
 import random
-from sqlalchemy.sql.functions import random as _random
 import os
-import schemas as _schemas
 import asyncio
 
-db = next(get_db())
+db = next(get_sync_db())
 
 USER_AMOUNT = 20
 SUBJECT_AMOUNT = 5
@@ -16,167 +30,203 @@ THEME_AMOUNT = 25
 TEACHER_AMOUNT = 500
 QUESTION_AMOUNT = 1000
 
+BATCH_SIZE = 10000
+NAME_POOL_SIZE = 1000
+TEST_QUESTIONS = 20
+TEST_THEMES = 5
+TEACHER_THEMES = 3
+TEST_PERIOD = datetime.timedelta(days=365)
+
+
+def insert(connection, table, rows):
+    """Inserts the rows of an iterable of dicts in executemany batches of BATCH_SIZE."""
+    rows = iter(rows)
+
+    while batch := list(itertools.islice(rows, BATCH_SIZE)):
+        connection.execute(table.insert(), batch)
+
 
-def fill_roles():
+def fill_roles(connection):
     print('-----------------------------------------------')
     print('Starting generating roles...')
 
-    roles = ["user", "administrator"]
-    for role in roles:
-        role_model = _models.Role(name=role)
-        db.add(role_model)
-        db.commit()
+    insert(connection, _models.Role.__table__, [{'id': 1, 'name': 'user'}, {'id': 2, 'name': 'administrator'}])
 
-    print('Clients generated.')
+    print('Roles generated.')
 
 
-def fill_users():
+def fill_users(connection, amount: int):
     print('-----------------------------------------------')
     print('Starting generating users...')
 
     fake = Faker("ru_RU")
+    names = [fake.name() for _ in range(min(amount, NAME_POOL_SIZE))]
 
-    admin_model = _models.User(email="admin@mail.ru", name="admin",
-                               hashed_password=_hash.bcrypt.hash("admin"), role_id=2)
-    db.add(admin_model)
-    db.commit()
+    # every generated user has the same password, so it is hashed once
+    admin_password, password = hash_passwords(["admin", "password"])
 
-    for i in range(USER_AMOUNT):
-        name = fake.name()
-        email = fake.email()
-        password = 'password'
+    users = ({'email': f'user{i}@mail.ru', 'name': random.choice(names), 'hashed_password': password, 'role_id': 1}
+             for i in range(amount))
+    admin = {'email': 'admin@mail.ru', 'name': 'admin', 'hashed_password': admin_password, 'role_id': 2}
+    insert(connection, _models.User.__table__, itertools.chain([admin], users))
 
-        user = _models.User(email=email, name=name, hashed_password=_hash.bcrypt.hash(password), role_id=1)
+    print(f'{amount} users generated.')
 
-        db.add(user)
-        db.commit()
 
-    print('Users generated.')
-
-
-def fill_subjects():
+def fill_subjects(connection, amount: int):
     print('-----------------------------------------------')
     print('Starting generating subjects...')
 
-    for i in range(SUBJECT_AMOUNT):
-        name = f"Example Subject {i}"
-
-        subject = _models.Subject(name=name)
+    insert(connection, _models.Subject.__table__,
+           ({'id': i, 'name': f"Example Subject {i - 1}"} for i in range(1, amount + 1)))
 
-        db.add(subject)
-        db.commit()
+    print(f'{amount} subjects generated.')
 
-    print('Subjects generated.')
 
-
-def fill_themes():
+def fill_themes(connection, amount: int, subject_amount: int):
+    """Returns the theme ids of every subject."""
     print('-----------------------------------------------')
     print('Starting generating themes...')
 
-    for i in range(THEME_AMOUNT):
-        name = f"Example Theme {i}"
-        description = f"Example Description {i}"
-        subject_id = random.randint(1, SUBJECT_AMOUNT)
+    subject_themes = {subject_id: [] for subject_id in range(1, subject_amount + 1)}
+    themes = []
 
-        theme = _models.Theme(name=name, description=description, subject_id=subject_id)
+    for theme_id in range(1, amount + 1):
+        subject_id = random.randint(1, subject_amount)
+        subject_themes[subject_id].append(theme_id)
+        themes.append({'id': theme_id, 'name': f"Example Theme {theme_id - 1}",
+                       'description': f"Example Description {theme_id - 1}", 'subject_id': subject_id})
 
-        db.add(theme)
-        db.commit()
+    insert(connection, _models.Theme.__table__, themes)
 
-    print('Themes generated.')
+    print(f'{amount} themes generated.')
+    return {subject_id: theme_ids for subject_id, theme_ids in subject_themes.items() if theme_ids}
 
 
-def fill_teachers():
+def fill_teachers(connection, amount: int, subject_themes: dict):
     print('-----------------------------------------------')
     print('Starting generating Teachers...')
 
-    fake = Faker("ru_RU")
-
-    for i in range(TEACHER_AMOUNT):
-        name = f"Example Teacher {i}"
-        phone_number = fake.phone_number()
+    subjects = list(subject_themes.values())
 
-        teacher = _models.Teacher(name=name, phone_number=phone_number)
+    def teacher_themes():
+        for teacher_id in range(1, amount + 1):
+            theme_ids = random.choice(subjects)
+            for theme_id in random.sample(theme_ids, min(TEACHER_THEMES, len(theme_ids))):
+                yield {'teacher_id': teacher_id, 'theme_id': theme_id}
 
-        themes = db.query(_models.Theme)\
-            .filter_by(subject_id=random.randint(1, SUBJECT_AMOUNT))\
-            .order_by(_random())\
-            .limit(3)\
-            .all()
+    insert(connection, _models.Teacher.__table__,
+           ({'id': i, 'name': f"Example Teacher {i - 1}", 'phone_number': f"+7 9{i:09d}"}
+            for i in range(1, amount + 1)))
+    insert(connection, _models.teacher_theme_association_table, teacher_themes())
 
-        teacher.themes = themes
+    print(f'{amount} teachers generated.')
 
-        db.add(teacher)
-        db.commit()
 
-    print('Teachers generated.')
-
-
-def fill_questions():
+def fill_questions(connection, amount: int, theme_amount: int):
+    """Returns the index of question ids per theme and the max mark of every question, by id."""
     print('-----------------------------------------------')
     print('Starting generating Questions...')
 
-    for i in range(QUESTION_AMOUNT):
-        text = f"Example Question {i}"
-        answer = "right" if i % 2 else "wrong"
-        max_mark = random.randint(1, 4)
-        theme_id = random.randint(1, THEME_AMOUNT)
-
-        question = _models.Question(text=text, answer=answer, max_mark=max_mark, theme_id=theme_id)
+    theme_ids = array.array('l', (random.randint(1, theme_amount) for _ in range(amount)))
+    max_marks = array.array('b', (random.randint(1, 4) for _ in range(amount + 1)))
 
-        db.add(question)
-        db.commit()
+    insert(connection, _models.Question.__table__,
+           ({'id': i + 1, 'text': f"Example Question {i}", 'answer': question_answer(i + 1),
+             'max_mark': max_marks[i + 1], 'theme_id': theme_ids[i]} for i in range(amount)))
+    duplicates.index(connection, ((i + 1, f"Example Question {i}") for i in range(amount)))
 
-    print('Questions generated.')
-
-
-async def fill_tests():
-    print('-----------------------------------------------')
-    print('Starting generating Tests...')
+    index = QuestionIndex()
+    index.load((i + 1, theme_id) for i, theme_id in enumerate(theme_ids))
 
-    users = db.query(_models.User).all()
+    print(f'{amount} questions generated.')
+    return index, max_marks
 
-    for user in users:
-        subject = db.query(_models.Subject).filter_by(id=random.randint(1, SUBJECT_AMOUNT)).first()
-        themes = subject.themes[:5]
-        theme_names = [theme.name for theme in themes]
-        await generate_test(subject.id, theme_names, db, user)
 
-    print('Tests generated.')
+def question_answer(question_id: int):
+    return "right" if (question_id - 1) % 2 else "wrong"
 
 
-async def fill_answers():
+def fill_tests(connection, amount: int, user_amount: int, answer_rate: float, subject_themes: dict, questions):
+    """Generates tests the way generate_test does, with every question answered with probability answer_rate."""
     print('-----------------------------------------------')
-    print('Starting generating Answers...')
+    print('Starting generating Tests and Answers...')
 
-    tests = db.query(_models.Test).all()
+    index, max_marks = questions
+    subjects = list(subject_themes.values())
+    now = datetime.datetime.utcnow()
+    answer_amount = 0
 
-    for test in tests:
+    for start in range(1, amount + 1, BATCH_SIZE):
+        tests, test_questions, answers = [], [], []
 
-        for question in test.questions:
-            answer = _schemas.AnswerCreate(given_answer="right", id=1)
+        for test_id in range(start, min(start + BATCH_SIZE, amount + 1)):
+            tests.append({'id': test_id, 'user_id': random.randint(1, user_amount + 1),
+                          'date': now - random.random() * TEST_PERIOD})
 
-            await create_answer(test.id, question.id, answer, db)
+            themes = random.choice(subjects)[:TEST_THEMES]
+            for theme_id, theme_amount in zip(themes, get_amounts(TEST_QUESTIONS, len(themes))):
+                for question_id in index.sample(theme_id, theme_amount):
+                    test_questions.append({'test_id': test_id, 'question_id': question_id})
 
-    print('Answers generated.')
+                    if random.random() < answer_rate:
+                        given_answer = random.choice(("right", "wrong"))
+                        key = AnswerKey(question_answer(question_id), max_marks[question_id], theme_id)
+                        answers.append({'test_id': test_id, 'question_id': question_id,
+                                        'given_answer': given_answer, 'mark': key.grade(given_answer)})
 
+        connection.execute(_models.Test.__table__.insert(), tests)
+        insert(connection, _models.test_question_association_table, test_questions)
+        insert(connection, _models.Answer.__table__, answers)
+        answer_amount += len(answers)
 
-fillers = [fill_roles, fill_users, fill_subjects, fill_themes, fill_teachers, fill_questions]
+    print(f'{amount} tests and {answer_amount} answers generated.')
 
 
 def setup():
-    os.remove(path="database.db")
+    url = make_url(_database.DATABASE_URL)
+
+    if url.get_backend_name() != "sqlite":
+        _database.Base.metadata.drop_all(bind=db.get_bind())
+    elif url.database and url.database != ":memory:":
+        for path in (url.database, url.database + "-wal", url.database + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
     create_database()
 
 
-async def fill():
+def fill(args):
     setup()
 
-    for filler in fillers:
-        filler()
+    with db.get_bind().begin() as connection:
+        fill_roles(connection)
+        fill_users(connection, args.users)
+        fill_subjects(connection, args.subjects)
+        subject_themes = fill_themes(connection, args.themes, args.subjects)
+        fill_teachers(connection, args.teachers, subject_themes)
+        questions = fill_questions(connection, args.questions, args.themes)
+        tests = args.users + 1 if args.tests is None else args.tests
+        fill_tests(connection, tests, args.users, args.answer_rate, subject_themes, questions)
+
+    print('-----------------------------------------------')
+    print('Filling user_theme_stats...')
+    asyncio.run(rebuild_theme_stats(db))
+    print('Filling question_stats...')
+    asyncio.run(rebuild_question_stats(db))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=USER_AMOUNT, help="users besides admin@mail.ru")
+    parser.add_argument("--subjects", type=int, default=SUBJECT_AMOUNT)
+    parser.add_argument("--themes", type=int, default=THEME_AMOUNT)
+    parser.add_argument("--teachers", type=int, default=TEACHER_AMOUNT)
+    parser.add_argument("--questions", type=int, default=QUESTION_AMOUNT)
+    parser.add_argument("--tests", type=int, default=None, help="defaults to one test per user")
+    parser.add_argument("--answer-rate", type=float, default=1.0, help="share of test questions that get answered")
+    return parser.parse_args()
 
-    await fill_tests()
-    await fill_answers()
 
 if __name__ == '__main__':
-    asyncio.run(fill())
+    fill(parse_args())
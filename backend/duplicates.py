@@ -0,0 +1,255 @@
+"""Near-duplicate detection for the question bank with MinHash signatures and LSH banding.
+
+A question's text is reduced to the set of its words and word pairs. Its signature is a one-permutation
+MinHash of that set: every word or pair is hashed once into one of SIGNATURE_SIZE bins, each bin keeps its
+smallest hash, and an empty bin copies the first filled bin of its own fixed pseudo-random probe order
+(optimal densification). The share of bins where two signatures agree estimates the Jaccard similarity
+of the two sets.
+
+The signature is cut into BANDS bands of ROWS bins and every band is hashed to a bucket. Questions
+sharing a bucket are candidates, so a lookup reads a few index ranges of question_bands instead of
+comparing against the whole bank. With 16 bands of 4 bins, pairs with a similarity of 0.5 become
+candidates about 64% of the time, pairs of 0.7 99% of the time. Buckets are read up to MAX_BUCKET_SIZE
+members, so a family of templated questions sharing a bucket can't make lookups linear again.
+
+The question services keep both tables up to date. For an existing database, or to list the clusters:
+
+    python duplicates.py --rebuild
+    python duplicates.py --threshold 0.8
+"""
+import argparse as _argparse
+import array as _array
+import hashlib as _hashlib
+import itertools as _itertools
+import random as _random
+import re as _re
+
+import sqlalchemy as _sql
+
+import database as _database
+import models as _models
+
+SIGNATURE_SIZE = 64
+BANDS = 16
+ROWS = SIGNATURE_SIZE // BANDS
+
+DEFAULT_THRESHOLD = 0.7
+MAX_CANDIDATES = 100
+MAX_BUCKET_SIZE = 1000
+BATCH_SIZE = 10000
+
+# the bins an empty bin tries in turn; signatures are stored, so the order comes from a fixed seed
+_seeded = _random.Random(SIGNATURE_SIZE)
+_PROBES = tuple(tuple(_seeded.sample(range(SIGNATURE_SIZE), SIGNATURE_SIZE)) for _ in range(SIGNATURE_SIZE))
+
+_signatures = _models.question_signature_table
+_bands = _models.question_band_table
+
+
+def shingles(text: str):
+    words = _re.findall(r"\w+", text.lower())
+    return set(words).union(f"{first} {second}" for first, second in zip(words, words[1:]))
+
+
+def _hash(value: bytes, signed: bool = False):
+    return int.from_bytes(_hashlib.blake2b(value, digest_size=8).digest(), "little", signed=signed)
+
+
+def signature(text: str):
+    """The signature of ``text`` as an array of SIGNATURE_SIZE 32-bit values, or None if it has no words."""
+    bins = [None] * SIGNATURE_SIZE
+
+    for shingle in shingles(text):
+        value = _hash(shingle.encode())
+        position, value = value % SIGNATURE_SIZE, value >> 32
+        current = bins[position]
+
+        if current is None or value < current:
+            bins[position] = value
+
+    filled = list(bins)
+
+    for position, value in enumerate(bins):
+        if value is None:
+            for probe in _PROBES[position]:
+                value = bins[probe]
+                if value is not None:
+                    break
+            else:
+                return None
+
+            filled[position] = value
+
+    return _array.array("I", filled)
+
+
+def load_signature(value: bytes):
+    result = _array.array("I")
+    result.frombytes(value)
+    return result
+
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return sum(x == y for x, y in zip(first, second)) / SIGNATURE_SIZE
+
+
+def buckets(signature):
+    """One bucket per band, as a signed 64-bit integer so it fits an SQLite INTEGER."""
+    data = signature.tobytes()
+    size = len(data) // BANDS
+
+    return [_hash(bytes([band]) + data[band * size:(band + 1) * size], signed=True) for band in range(BANDS)]
+
+
+def index_rows(questions):
+    """question_signatures and question_bands rows for an iterable of (question id, text) pairs."""
+    signature_rows, band_rows = [], []
+
+    for question_id, text in questions:
+        question_signature = signature(text)
+
+        if question_signature is None:
+            continue
+
+        signature_rows.append({"question_id": question_id, "signature": question_signature.tobytes()})
+        band_rows.extend({"bucket": bucket, "question_id": question_id} for bucket in buckets(question_signature))
+
+    return signature_rows, band_rows
+
+
+def delete_statements(question_id: int, signature):
+    return [
+        _bands.delete().where(_bands.c.bucket.in_(buckets(signature)), _bands.c.question_id == question_id),
+        _signatures.delete().where(_signatures.c.question_id == question_id),
+    ]
+
+
+def candidates_statement(signature):
+    """Ids of the questions sharing a bucket with ``signature``, once per shared bucket."""
+    members = [
+        _sql.select(_bands.c.question_id).filter(_bands.c.bucket == bucket).limit(MAX_BUCKET_SIZE).subquery()
+        for bucket in buckets(signature)
+    ]
+
+    return _sql.union_all(*(_sql.select(subquery.c.question_id) for subquery in members))
+
+
+def signatures_statement(question_ids):
+    return _sql.select(_signatures.c.question_id, _signatures.c.signature).filter(
+        _signatures.c.question_id.in_(question_ids)
+    )
+
+
+def bands_statement(after=None):
+    """The next BATCH_SIZE rows of question_bands in (bucket, question id) order, after the row ``after``."""
+    statement = _sql.select(_bands.c.bucket, _bands.c.question_id).order_by(_bands.c.bucket, _bands.c.question_id)
+
+    if after is not None:
+        statement = statement.filter(_sql.tuple_(_bands.c.bucket, _bands.c.question_id) > tuple(after))
+
+    return statement.limit(BATCH_SIZE)
+
+
+class ClusterScan:
+    """Candidate duplicate pairs of the whole bank, from one pass over question_bands.
+
+    feed() takes the rows of bands_statement in chunks of any size. Every member of a bucket is paired
+    with the first member only, up to MAX_BUCKET_SIZE members, so the scan stays linear in the number of
+    rows; duplicates missed that way nearly always meet in another band.
+    """
+
+    def __init__(self):
+        self.pairs = set()
+        self._bucket = None
+        self._first = None
+        self._size = 0
+
+    def feed(self, rows):
+        for bucket, question_id in rows:
+            if bucket != self._bucket:
+                self._bucket, self._first, self._size = bucket, question_id, 1
+            elif self._size < MAX_BUCKET_SIZE:
+                self._size += 1
+                self.pairs.add((self._first, question_id))
+
+    def question_ids(self):
+        return sorted({question_id for pair in self.pairs for question_id in pair})
+
+
+def clusters(pairs, signatures: dict, threshold: float = DEFAULT_THRESHOLD):
+    """Groups of question ids joined by the ``pairs`` whose signatures are similar enough, largest first."""
+    parents = {}
+
+    def find(question_id):
+        root = question_id
+        while parents[root] != root:
+            root = parents[root]
+
+        while question_id != root:
+            parents[question_id], question_id = root, parents[question_id]
+
+        return root
+
+    for first, second in pairs:
+        if similarity(signatures[first], signatures[second]) >= threshold:
+            parents.setdefault(first, first)
+            parents.setdefault(second, second)
+            parents[find(second)] = find(first)
+
+    groups = {}
+    for question_id in parents:
+        groups.setdefault(find(question_id), []).append(question_id)
+
+    return sorted((sorted(group) for group in groups.values()), key=lambda group: (-len(group), group[0]))
+
+
+def index(connection, questions):
+    """Adds the signatures of an iterable of (question id, text) pairs in batches of BATCH_SIZE."""
+    questions = iter(questions)
+
+    while batch := list(_itertools.islice(questions, BATCH_SIZE)):
+        signature_rows, band_rows = index_rows(batch)
+
+        if signature_rows:
+            connection.execute(_signatures.insert(), signature_rows)
+            connection.execute(_bands.insert(), band_rows)
+
+
+def rebuild(connection):
+    """Recomputes the signatures of every question."""
+    connection.execute(_bands.delete())
+    connection.execute(_signatures.delete())
+
+    last_id = 0
+    while batch := connection.execute(
+            _sql.select(_models.Question.id, _models.Question.text)
+            .filter(_models.Question.id > last_id).order_by(_models.Question.id).limit(BATCH_SIZE)
+    ).all():
+        index(connection, batch)
+        last_id = batch[-1].id
+
+
+def main():
+    import asyncio
+    import services as _services
+
+    parser = _argparse.ArgumentParser(description=__doc__, formatter_class=_argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="recompute every signature first")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.rebuild:
+        with _database.engine.begin() as connection:
+            rebuild(connection)
+
+    db = _database.SessionLocal()
+    try:
+        for cluster in asyncio.run(_services.get_duplicate_clusters(db, args.threshold)):
+            print(" ".join(map(str, cluster.question_ids)))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
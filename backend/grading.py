@@ -0,0 +1,53 @@
+from typing import Dict, List
+
+import cache as _cache
+
+ANSWER_SEPARATOR = '; '
+
+
+class AnswerKey:
+    """The right answer of a question, split once into the set of expected parts."""
+
+    __slots__ = ('answer', 'answers', 'max_mark', 'theme_id')
+
+    def __init__(self, answer: str, max_mark: int, theme_id: int):
+        self.answer = answer
+        self.answers = frozenset(str(answer).split(ANSWER_SEPARATOR))
+        self.max_mark = max_mark
+        self.theme_id = theme_id
+
+    def grade(self, given_answer: str):
+        if self.max_mark == 1:
+            return 1 if self.answer == given_answer else 0
+
+        given_answers = set(given_answer.split(ANSWER_SEPARATOR))
+
+        if len(given_answers) > len(self.answers):
+            mark = len(self.answers) - len(given_answers)
+        else:
+            mark = 0
+        mark += len(self.answers.intersection(given_answers))
+        return max(0, mark)
+
+
+class AnswerKeyCache(_cache.TTLCache):
+    """Answer keys by question id, so grading a warm question needs no database access."""
+
+    def get_many(self, question_ids: List[int]):
+        keys = {}
+        missing = []
+
+        for question_id in question_ids:
+            key = self.get(question_id)
+
+            if key is None:
+                missing.append(question_id)
+            else:
+                keys[question_id] = key
+
+        return keys, missing
+
+
+def grade_answers(keys: Dict[int, AnswerKey], answers):
+    """Marks for answers carrying question_id and given_answer, graded against keys by question id."""
+    return [keys[answer.question_id].grade(answer.given_answer) for answer in answers]
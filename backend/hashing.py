@@ -0,0 +1,25 @@
+import asyncio as _asyncio
+import concurrent.futures as _futures
+import os as _os
+from typing import List
+
+import passlib.hash as _hash
+
+# bcrypt releases the GIL while hashing, so a thread per core is enough to use every core
+HASH_WORKERS = int(_os.environ.get("HASH_WORKERS", _os.cpu_count() or 1))
+
+executor = _futures.ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+
+
+async def hash_password(password: str):
+    loop = _asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _hash.bcrypt.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str):
+    loop = _asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _hash.bcrypt.verify, password, hashed_password)
+
+
+def hash_passwords(passwords: List[str]):
+    return list(executor.map(_hash.bcrypt.hash, passwords))
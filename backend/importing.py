@@ -0,0 +1,95 @@
+"""Bulk import of questions from CSV or JSON Lines files.
+
+Every row holds a question's text, answer and max_mark and names its theme, either by theme_id or by
+the names of its subject and theme (columns subject and theme). Rows are read from the file one at a
+time and the services insert them in batches of BATCH_SIZE, one transaction per batch. Rows that fail
+validation, name an unknown theme or repeat a question of the file or the bank are reported with
+their line number instead of stopping the import. From the backend directory:
+
+    python importing.py questions.jsonl
+    python importing.py questions.csv
+"""
+import argparse as _argparse
+import csv as _csv
+import json as _json
+
+import pydantic as _pydantic
+
+import database as _database
+import schemas as _schemas
+
+FORMATS = ("csv", "jsonl")
+BATCH_SIZE = 5000
+
+
+def format_of(filename: str):
+    return "csv" if (filename or "").lower().endswith(".csv") else "jsonl"
+
+
+def read_rows(file, format: str):
+    """(line number, row) pairs of a text file; a row that can't be read is an error message instead of a dict.
+
+    A file that breaks off in the middle, with invalid UTF-8 or a malformed CSV quote, ends with an error.
+    """
+    line = 0
+
+    try:
+        if format == "csv":
+            reader = _csv.DictReader(file)
+
+            for row in reader:
+                line = reader.line_num
+                yield line, {key: value for key, value in row.items() if key is not None and value not in ("", None)}
+        else:
+            for line, text in enumerate(file, start=1):
+                if not text.strip():
+                    continue
+
+                try:
+                    row = _json.loads(text)
+                except ValueError as error:
+                    yield line, f"Invalid JSON: {error}"
+                    continue
+
+                yield line, row if isinstance(row, dict) else "Expected a JSON object"
+    except (UnicodeDecodeError, _csv.Error) as error:
+        yield line + 1, f"Unreadable file: {error}"
+
+
+def parse(row: dict):
+    """The row as a QuestionImport, or an error message."""
+    try:
+        question = _schemas.QuestionImport.parse_obj(row)
+    except _pydantic.ValidationError as error:
+        return "; ".join(f"{'.'.join(map(str, detail['loc']))}: {detail['msg']}" for detail in error.errors())
+
+    if question.theme_id is None and (question.subject is None or question.theme is None):
+        return "Either theme_id or subject and theme are required"
+
+    return question
+
+
+def main():
+    import asyncio
+    import services as _services
+
+    parser = _argparse.ArgumentParser(description=__doc__, formatter_class=_argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="defaults to csv for .csv files and jsonl otherwise")
+    args = parser.parse_args()
+
+    db = _database.SessionLocal()
+    try:
+        with open(args.path, encoding="utf-8-sig", newline="") as file:
+            report = asyncio.run(_services.import_questions(file, args.format or format_of(args.path), db))
+    finally:
+        db.close()
+
+    for error in report.errors:
+        print(f"line {error.line}: {error.error}")
+
+    print(f"{report.imported} questions imported, {len(report.errors)} rows rejected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Loader options for the queries whose rows are turned into response schemas.
+
+Each profile loads exactly the relationships its schema walks, so building a response never lazy
+loads per row and an endpoint runs the same number of queries whatever the size of the result.
+Collections use selectin loading (one extra query per collection), many-to-one relations a join.
+"""
+import sqlalchemy.orm as _orm
+
+import models as _models
+
+# schemas.Principal, through services.create_token
+PRINCIPAL = (_orm.joinedload(_models.User.role),)
+
+# schemas.Teacher and schemas.TeacherRecommendation
+TEACHER = (_orm.selectinload(_models.Teacher.themes),)
+
+# schemas.Subject
+SUBJECT = (_orm.selectinload(_models.Subject.themes),)
+
+# schemas.Theme
+THEME = (
+    _orm.selectinload(_models.Theme.teachers),
+    _orm.joinedload(_models.Theme.subject),
+)
+
+# schemas.Question
+QUESTION = (_orm.joinedload(_models.Question.theme),)
+
+# schemas.Test
+TEST = (_orm.selectinload(_models.Test.questions),)
+
+# schemas.TestCompleted, and answer submission which updates the answers of the test
+TEST_COMPLETED = (_orm.selectinload(_models.Test.questions), _orm.selectinload(_models.Test.answers))
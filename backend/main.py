@@ -1,10 +1,14 @@
-from typing import List, Tuple
+import io as _io
+from typing import List, Optional, Tuple
 import fastapi as _fastapi
+import fastapi.responses as _responses
 import fastapi.security as _security
 
 import sqlalchemy.orm as _orm
 
-import services as _services, schemas as _schemas
+import database as _database, duplicates as _duplicates, importing as _importing, metrics as _metrics
+import replication as _replication, services as _services, schemas as _schemas, serialization as _serialization
+import search as _search
 
 tags_metadata = [
     {
@@ -35,10 +39,71 @@ tags_metadata = [
         "name": "Tests",
         "description": "Operations with Tests",
     },
+    {
+        "name": "Export",
+        "description": "Streaming exports of the question bank and results",
+    },
 ]
 
 app = _fastapi.FastAPI(openapi_tags=tags_metadata)
 
+_metrics.instrument(_database.engine)
+if _database.REPLICA_DATABASE_URL is not None:
+    _metrics.instrument(_database.replica_engine)
+if _database.USE_ASYNC_DATABASE:
+    _metrics.instrument(_database.async_engine.sync_engine)
+    if _database.REPLICA_DATABASE_URL is not None:
+        _metrics.instrument(_database.async_replica_engine.sync_engine)
+
+if _database.REPLICA_DATABASE_URL is not None and _replication.SQLITE_REPLICATION_INTERVAL is not None:
+    _replicator = _replication.SqliteReplicator(
+        _database.DATABASE_URL, _database.REPLICA_DATABASE_URL, float(_replication.SQLITE_REPLICATION_INTERVAL)
+    )
+    app.add_event_handler("startup", _replicator.start)
+    app.add_event_handler("shutdown", _replicator.stop)
+
+app.add_event_handler("startup", _services.pooled_tests.start)
+app.add_event_handler("shutdown", _services.pooled_tests.stop)
+
+
+def _route_path(request: _fastapi.Request):
+    endpoint = request.scope.get("endpoint")
+
+    for route in app.routes:
+        if endpoint is not None and getattr(route, "endpoint", None) is endpoint:
+            return route.path
+
+    return "unmatched"
+
+
+@app.middleware("http")
+async def record_metrics(request: _fastapi.Request, call_next):
+    stats = _metrics.start_request()
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        _metrics.observe_request(request.method, _route_path(request), 500, stats)
+        raise
+
+    _metrics.observe_request(request.method, _route_path(request), response.status_code, stats)
+    return response
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return _fastapi.Response(content=_metrics.render(), media_type=_metrics.CONTENT_TYPE)
+
+
+async def _catalog_response(request: _fastapi.Request, key, load):
+    etag, body = await _services.get_catalog_response(key, load)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag in [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]:
+        return _fastapi.Response(status_code=304, headers=headers)
+
+    return _fastapi.Response(content=body, media_type="application/json", headers=headers)
+
 
 # --------------USER-API----------------------
 @app.post("/api/users", tags=["Users"])
@@ -52,9 +117,13 @@ async def create_user(user: _schemas.UserCreate, db: _orm.Session = _fastapi.Dep
     return await _services.create_token(user)
 
 
-@app.get("/api/users", tags=["Users"], response_model=List[_schemas.User])
-async def get_users(db: _orm.Session = _fastapi.Depends(_services.get_db)):
-    return await _services.get_users(db)
+@app.get("/api/users", tags=["Users"], response_model=_schemas.Page[_schemas.User])
+async def get_users(
+        cursor: Optional[int] = None,
+        limit: int = _fastapi.Query(default=_services.PAGE_SIZE, ge=1, le=_services.MAX_PAGE_SIZE),
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db)
+):
+    return await _services.get_users(db, cursor, limit)
 
 
 @app.get("/api/users/me", tags=["Users"], response_model=_schemas.User)
@@ -63,7 +132,7 @@ async def get_current_user(user: _schemas.User = _fastapi.Depends(_services.get_
 
 
 @app.get("/api/users/{user_id}", tags=["Users"], status_code=200)
-async def get_user(user_id: int, db: _orm.Session = _fastapi.Depends(_services.get_db)):
+async def get_user(user_id: int, db: _orm.Session = _fastapi.Depends(_services.get_read_db)):
     return await _services.get_user(user_id, db)
 
 
@@ -85,27 +154,29 @@ async def update_user(
         db: _orm.Session = _fastapi.Depends(_services.get_db),
         current_user: _schemas.User = _fastapi.Depends(_services.get_current_user)
 ):
-    await _services.update_user(user_id, user, current_user, db)
-    return {"message": "Updated Successfully"}
+    user = await _services.update_user(user_id, user, current_user, db)
+
+    # the update revoked the caller's token
+    return {"message": "Updated Successfully", **await _services.create_token(user)}
 
 
 @app.get('/api/users/{user_id}/tests', tags=['Users'],
-         response_model=Tuple[List[_schemas.TestCompleted], List[_schemas.Teacher]])
+         response_model=Tuple[_schemas.Page[_schemas.TestCompleted], List[_schemas.TeacherRecommendation]])
 async def get_test_results(
         user_id: int,
-        db: _orm.Session = _fastapi.Depends(_services.get_db),
+        cursor: Optional[int] = None,
+        limit: int = _fastapi.Query(default=_services.PAGE_SIZE, ge=1, le=_services.MAX_PAGE_SIZE),
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db),
         current_user: _schemas.User = _fastapi.Depends(_services.get_current_user)
 ):
     if user_id != current_user.id:
         raise _fastapi.HTTPException(status_code=403, detail="Cannot view other user results")
 
-    tests = await _services.get_test_answers(db, current_user)
-    test_schemas = list(map(_schemas.TestCompleted.from_orm, tests))
+    tests = await _services.get_test_answers(db, current_user, cursor, limit)
 
-    teachers = await _services.get_teacher_recommendations(tests, db)
-    teachers = list(map(_schemas.Teacher.from_orm, teachers))
+    teachers = await _services.get_teacher_recommendations(current_user.id, db)
 
-    return test_schemas, teachers
+    return tests, teachers
 
 
 # ------------------------LOGIN-API------------------------------
@@ -136,13 +207,23 @@ async def create_teacher(teacher: _schemas.TeacherCreate,
     return _schemas.Teacher.from_orm(teacher)
 
 
-@app.get("/api/teachers", tags=["Teachers"], response_model=List[_schemas.Teacher])
-async def get_teachers(db: _orm.Session = _fastapi.Depends(_services.get_db)):
-    return await _services.get_teachers(db)
+@app.get("/api/teachers", tags=["Teachers"], response_model=_schemas.Page[_schemas.Teacher])
+async def get_teachers(
+        request: _fastapi.Request,
+        cursor: Optional[int] = None,
+        limit: int = _fastapi.Query(default=_services.PAGE_SIZE, ge=1, le=_services.MAX_PAGE_SIZE),
+        theme_id: Optional[int] = None,
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db)
+):
+    get_teachers = _services.get_teacher_rows if _serialization.FAST_RESPONSES else _services.get_teachers
+
+    return await _catalog_response(
+        request, ("teachers", cursor, limit, theme_id), lambda: get_teachers(db, cursor, limit, theme_id)
+    )
 
 
 @app.get("/api/teachers/{teacher_id}", tags=["Teachers"], status_code=200)
-async def get_teacher(teacher_id: int, db: _orm.Session = _fastapi.Depends(_services.get_db)):
+async def get_teacher(teacher_id: int, db: _orm.Session = _fastapi.Depends(_services.get_read_db)):
     return await _services.get_teacher(teacher_id, db)
 
 
@@ -186,14 +267,25 @@ async def create_subject(
     return _schemas.Subject.from_orm(subject)
 
 
-@app.get("/api/subjects", tags=["Subjects"], response_model=List[_schemas.Subject])
-async def get_subjects(db: _orm.Session = _fastapi.Depends(_services.get_db)):
-    return await _services.get_subjects(db)
+@app.get("/api/subjects", tags=["Subjects"], response_model=_schemas.Page[_schemas.Subject])
+async def get_subjects(
+        request: _fastapi.Request,
+        cursor: Optional[int] = None,
+        limit: int = _fastapi.Query(default=_services.PAGE_SIZE, ge=1, le=_services.MAX_PAGE_SIZE),
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db)
+):
+    return await _catalog_response(
+        request, ("subjects", cursor, limit), lambda: _services.get_subjects(db, cursor, limit)
+    )
 
 
-@app.get("/api/subjects/{subject_id}", tags=["Subjects"], status_code=200)
-async def get_subject(subject_id: int, db: _orm.Session = _fastapi.Depends(_services.get_db)):
-    return await _services.get_subject(subject_id, db)
+@app.get("/api/subjects/{subject_id}", tags=["Subjects"], status_code=200, response_model=_schemas.Subject)
+async def get_subject(
+        request: _fastapi.Request,
+        subject_id: int,
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db)
+):
+    return await _catalog_response(request, ("subject", subject_id), lambda: _services.get_subject(subject_id, db))
 
 
 @app.delete("/api/subjects/{subject_id}", tags=["Subjects"], status_code=204)
@@ -237,21 +329,29 @@ async def create_theme(
     return _schemas.Theme.from_orm(theme)
 
 
-@app.get('/api/subjects/{subject_id}/themes', tags=["Themes"], response_model=List[_schemas._ThemeBase])
+@app.get('/api/subjects/{subject_id}/themes', tags=["Themes"], response_model=_schemas.Page[_schemas._ThemeBase])
 async def get_themes(
+        request: _fastapi.Request,
         subject_id: int,
-        db: _orm.Session = _fastapi.Depends(_services.get_db)
+        cursor: Optional[int] = None,
+        limit: int = _fastapi.Query(default=_services.PAGE_SIZE, ge=1, le=_services.MAX_PAGE_SIZE),
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db)
 ):
-    return await _services.get_themes(subject_id, db)
+    return await _catalog_response(
+        request, ("themes", subject_id, cursor, limit), lambda: _services.get_themes(subject_id, db, cursor, limit)
+    )
 
 
-@app.get('/api/subjects/{subject_id}/themes/{theme_id}', tags=["Themes"], status_code=200)
+@app.get('/api/subjects/{subject_id}/themes/{theme_id}', tags=["Themes"], status_code=200,
+         response_model=_schemas.Theme)
 async def get_theme(
         subject_id: int,
         theme_id: int,
-        db: _orm.Session = _fastapi.Depends(_services.get_db),
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db),
 ):
-    return await _services.get_theme(subject_id, theme_id, db)
+    # without its questions, which can be tens of thousands; they are listed page by page at /api/questions?theme_id=
+    theme = await _services.get_theme(subject_id, theme_id, db)
+    return _schemas.Theme.from_orm(theme)
 
 
 @app.put('/api/subjects/{subject_id}/themes/{theme_id}', tags=["Themes"], status_code=200)
@@ -280,18 +380,74 @@ async def delete_theme(
 
 
 # ----------------------------------------QUESTION-API------------------------------
+@app.get('/api/questions/search', tags=['Questions'], response_model=_schemas.SearchPage,
+         description=f'Ranks the first {_search.MAX_RANKED} matches in id order; truncated is true when more '
+                     f'questions match, and those can only be found by narrowing the query or with theme_id.')
+async def search_questions(
+        q: str,
+        cursor: Optional[int] = _fastapi.Query(default=None, ge=0),
+        limit: int = _fastapi.Query(default=_services.PAGE_SIZE, ge=1, le=_services.MAX_PAGE_SIZE),
+        theme_id: Optional[int] = None,
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db)
+):
+    return await _services.search_questions(q, db, cursor, limit, theme_id)
+
+
+@app.post('/api/questions/import', tags=['Questions'], response_model=_schemas.ImportReport)
+async def import_questions(
+        file: _fastapi.UploadFile,
+        format: Optional[str] = _fastapi.Query(default=None, regex='^(csv|jsonl)$'),
+        db: _orm.Session = _fastapi.Depends(_services.get_sync_db),
+        current_user: _schemas.User = _fastapi.Depends(_services.get_current_admin)
+):
+    text = _io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
+
+    # reading, signing and inserting take seconds per ten thousand rows
+    return await _services.in_worker_thread(
+        _services.import_questions(text, format or _importing.format_of(file.filename), db)
+    )
+
+
+@app.post('/api/questions/duplicates', tags=['Questions'], response_model=List[_schemas.DuplicateCandidate])
+async def find_duplicate_questions(
+        question: _schemas.DuplicateCheck,
+        threshold: float = _fastapi.Query(default=_duplicates.DEFAULT_THRESHOLD, ge=0, le=1),
+        limit: int = _fastapi.Query(default=10, ge=1, le=_duplicates.MAX_CANDIDATES),
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db)
+):
+    return await _services.find_duplicates(question.text, db, threshold, limit)
+
+
+@app.get('/api/questions/duplicates/clusters', tags=['Questions'], response_model=List[_schemas.DuplicateCluster])
+async def get_duplicate_clusters(
+        threshold: float = _fastapi.Query(default=_duplicates.DEFAULT_THRESHOLD, ge=0, le=1),
+        db: _orm.Session = _fastapi.Depends(_services.get_sync_read_db),
+        current_user: _schemas.User = _fastapi.Depends(_services.get_current_admin)
+):
+    # goes through every signature band of the bank
+    return await _services.in_worker_thread(_services.get_duplicate_clusters(db, threshold))
+
+
 @app.get('/api/questions/{question_id}', tags=["Questions"], status_code=200, response_model=_schemas.Question)
 async def get_question(
         question_id: int,
-        db: _orm.Session = _fastapi.Depends(_services.get_db),
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db),
 ):
     question = await _services.get_question(question_id, db)
     return _schemas.Question.from_orm(question)
 
 
-@app.get('/api/questions', tags=['Questions'], response_model=List[_schemas.Question])
-async def get_questions(db: _orm.Session = _fastapi.Depends(_services.get_db)):
-    return await _services.get_questions(db)
+@app.get('/api/questions', tags=['Questions'], response_model=_schemas.Page[_schemas.Question])
+async def get_questions(
+        cursor: Optional[int] = None,
+        limit: int = _fastapi.Query(default=_services.PAGE_SIZE, ge=1, le=_services.MAX_PAGE_SIZE),
+        theme_id: Optional[int] = None,
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db)
+):
+    if _serialization.FAST_RESPONSES:
+        return _serialization.response(await _services.get_question_rows(db, cursor, limit, theme_id))
+
+    return await _services.get_questions(db, cursor, limit, theme_id)
 
 
 @app.post('/api/questions/{theme_id}', tags=['Questions'])
@@ -350,11 +506,21 @@ async def create_or_update_answer(
     return answer
 
 
+@app.post('/api/subjects/{subject_id}/tests/{test_id}/answers', tags=['Answers'], response_model=List[_schemas.Answer])
+async def submit_answers(
+        test_id: int,
+        answers: List[_schemas.AnswerSubmit],
+        db: _orm.Session = _fastapi.Depends(_services.get_db),
+        current_user: _schemas.User = _fastapi.Depends(_services.get_current_user)
+):
+    return await _services.submit_answers(test_id, answers, db, current_user)
+
+
 # ----------------------------------------TEST-API------------------------------
 @app.get("/api/subjects/{subject_id}/tests/{test_id}", tags=['Tests'])
 async def get_test(
         test_id: int,
-        db: _orm.Session = _fastapi.Depends(_services.get_db),
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db),
         current_user: _schemas.User = _fastapi.Depends(_services.get_current_user)
 ):
     test = await _services.get_test(test_id, db, current_user)
@@ -366,12 +532,42 @@ async def get_test(
 async def generate_test(
         subject_id: int,
         theme_names: List[str] = _fastapi.Query(default=[]),
+        adaptive: bool = False,
         db: _orm.Session = _fastapi.Depends(_services.get_db),
         current_user: _schemas.User = _fastapi.Depends(_services.get_current_user)
 ):
     if not theme_names:
         raise _fastapi.HTTPException(status_code=400, detail='No theme names given')
 
-    test = await _services.generate_test(subject_id, theme_names, db, current_user)
+    test = await _services.generate_test(subject_id, theme_names, db, current_user, adaptive)
 
     return _schemas.Test.from_orm(test)
+
+
+@app.get('/api/subjects/{subject_id}/themes/{theme_id}/weights', tags=['Tests'],
+         response_model=List[_schemas.QuestionWeight])
+async def get_question_weights(
+        subject_id: int,
+        theme_id: int,
+        user_id: Optional[int] = None,
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db),
+        current_user: _schemas.User = _fastapi.Depends(_services.get_current_admin)
+):
+    return await _services.get_question_weights(subject_id, theme_id, db, user_id)
+
+
+# ----------------------------------------EXPORT-API------------------------------
+@app.get('/api/export/{table}', tags=['Export'])
+async def export_table(
+        table: str,
+        format: str = _fastapi.Query(default='ndjson', regex='^(ndjson|csv)$'),
+        db: _orm.Session = _fastapi.Depends(_services.get_read_db),
+        current_user: _schemas.User = _fastapi.Depends(_services.get_current_admin)
+):
+    if table not in _services.EXPORTS:
+        raise _fastapi.HTTPException(status_code=404, detail='Unknown export')
+
+    if format == 'csv':
+        return _responses.StreamingResponse(_services.export_csv(table, db), media_type='text/csv')
+
+    return _responses.StreamingResponse(_services.export_ndjson(table, db), media_type='application/x-ndjson')
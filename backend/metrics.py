@@ -0,0 +1,142 @@
+"""Request and SQL metrics per route, rendered in the Prometheus text exposition format.
+
+main.py opens a RequestStats for every request; the engine hooks installed by instrument() add the
+statements executed while handling it, so each route reports its latency, how many statements a
+request runs and how long they take. A route whose statement count grows with the size of its
+response is lazy loading per row.
+"""
+import contextvars as _contextvars
+import threading as _threading
+import time as _time
+
+import sqlalchemy.event as _event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_request_stats = _contextvars.ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    __slots__ = ("started", "statements", "sql_seconds")
+
+    def __init__(self):
+        self.started = _time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = _threading.Lock()
+
+    def inc(self, labels: tuple, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = _threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            counts, total, count = self._values.get(labels) or ([0] * len(self.buckets), 0.0, 0)
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+
+            self._values[labels] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts + [count]):
+                    bucket_labels = _labels(self.labels + ("le",), labels + (bound,))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+
+                lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+
+        return lines
+
+
+_ROUTE_LABELS = ("method", "route")
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Time to produce the response, up to its first byte.",
+    _ROUTE_LABELS + ("status",), LATENCY_BUCKETS
+)
+request_statements = Histogram(
+    "http_request_sql_statements", "SQL statements executed per request.", _ROUTE_LABELS, STATEMENT_BUCKETS
+)
+sql_statements = Counter("sql_statements_total", "SQL statements executed.", _ROUTE_LABELS)
+sql_duration = Counter("sql_duration_seconds_total", "Time spent executing SQL statements.", _ROUTE_LABELS)
+
+REGISTRY = (request_duration, request_statements, sql_statements, sql_duration)
+
+
+def instrument(engine):
+    """Adds the statements executed on ``engine``, a sync Engine, and their duration to the current request."""
+    @_event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(_time.perf_counter())
+
+    @_event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = _time.perf_counter() - conn.info["metrics_started"].pop()
+        stats = _request_stats.get()
+
+        if stats is not None:
+            stats.statements += 1
+            stats.sql_seconds += elapsed
+
+
+def start_request():
+    stats = RequestStats()
+    _request_stats.set(stats)
+    return stats
+
+
+def observe_request(method: str, route: str, status: int, stats: RequestStats):
+    labels = (method, route)
+
+    request_duration.observe(labels + (str(status),), _time.perf_counter() - stats.started)
+    request_statements.observe(labels, stats.statements)
+    sql_statements.inc(labels, stats.statements)
+    sql_duration.inc(labels, stats.sql_seconds)
+
+
+def render():
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
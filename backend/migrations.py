@@ -0,0 +1,107 @@
+"""Brings an existing database up to the current models.
+
+Creates missing tables, adds missing columns and creates missing indexes, then backfills user_theme_stats,
+question_stats, the question_search full-text index and the near-duplicate signatures if they were just
+created. A unique index that existing rows break is skipped and the repeated values reported, so they can
+be removed and the migration run again. Run from the backend directory:
+
+    python migrations.py
+"""
+import asyncio
+
+import sqlalchemy as _sql
+
+import database as _database
+import duplicates as _duplicates
+import models as _models
+import search as _search
+import services as _services
+
+
+def _add_column(connection, table: _sql.Table, column: _sql.Column):
+    column_type = column.type.compile(dialect=connection.dialect)
+    statement = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+
+    if column.default is not None and column.default.is_scalar:
+        statement += f' NOT NULL DEFAULT {column.default.arg!r}'
+
+    connection.execute(_sql.text(statement))
+
+    # a default computed per row, such as users.token_version, is filled in row by row
+    if column.default is not None and column.default.is_callable:
+        key = list(table.primary_key)[0]
+
+        for row_id in connection.execute(_sql.select(key)).scalars().all():
+            connection.execute(table.update().where(key == row_id).values({column.name: column.default.arg(None)}))
+
+
+def _find_duplicates(connection, index: _sql.Index):
+    """The values of ``index``'s columns that more than one row has."""
+    columns = list(index.columns)
+    repeated = _sql.select(*columns).group_by(*columns).having(_sql.func.count() > 1)
+
+    return connection.execute(repeated).all()
+
+
+def migrate(engine=_database.engine):
+    existing_tables = set(_sql.inspect(engine).get_table_names())
+
+    _database.Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        inspector = _sql.inspect(connection)
+
+        for table in _database.Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    print(f'Adding column {table.name}.{column.name}')
+                    _add_column(connection, table, column)
+
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in indexes:
+                    continue
+
+                if index.unique and (duplicates := _find_duplicates(connection, index)):
+                    columns = ', '.join(column.name for column in index.columns)
+                    print(f'Skipping unique index {index.name}: {len(duplicates)} values of ({columns}) are repeated, '
+                          f'e.g. {tuple(duplicates[0])}. Remove the repeated rows and run again')
+                    continue
+
+                print(f'Creating index {index.name}')
+                index.create(connection)
+
+    if existing_tables and _search.TABLE not in existing_tables and engine.dialect.name == 'sqlite':
+        print('Filling question_search')
+        with engine.begin() as connection:
+            _search.create(connection)
+            _search.rebuild(connection)
+
+    if existing_tables and _models.question_signature_table.name not in existing_tables:
+        print('Filling question_signatures')
+        with engine.begin() as connection:
+            _duplicates.rebuild(connection)
+
+    if existing_tables and _models.UserThemeStats.__tablename__ not in existing_tables:
+        print('Filling user_theme_stats')
+        db = _database.SessionLocal(bind=engine)
+        try:
+            asyncio.run(_services.rebuild_theme_stats(db))
+        finally:
+            db.close()
+
+    if existing_tables and _models.QuestionStats.__tablename__ not in existing_tables:
+        print('Filling question_stats')
+        db = _database.SessionLocal(bind=engine)
+        try:
+            asyncio.run(_services.rebuild_question_stats(db))
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    migrate()
@@ -1,7 +1,8 @@
 import datetime as _dt
+import secrets as _secrets
 from sqlalchemy import (
-    Column, ForeignKey, Table,
-    Integer, String, DateTime
+    Column, ForeignKey, Table, Index,
+    Integer, String, DateTime, Float, LargeBinary
 )
 from database import Base
 from sqlalchemy.orm import relationship
@@ -11,16 +12,42 @@ teacher_theme_association_table = Table(
     'teacher_theme',
     Base.metadata,
     Column('teacher_id', ForeignKey("teachers.id")),
-    Column('theme_id', ForeignKey('themes.id'))
+    Column('theme_id', ForeignKey('themes.id')),
+    Index('ix_teacher_theme_teacher_id_theme_id', 'teacher_id', 'theme_id', unique=True),
+    Index('ix_teacher_theme_theme_id', 'theme_id'),
 )
 
 test_question_association_table = Table(
     'test_question',
     Base.metadata,
     Column('test_id', ForeignKey("tests.id")),
-    Column('question_id', ForeignKey("questions.id"))
+    Column('question_id', ForeignKey("questions.id")),
+    Index('ix_test_question_test_id_question_id', 'test_id', 'question_id', unique=True),
+    Index('ix_test_question_question_id', 'question_id'),
 )
 
+# MinHash signature of every question and the LSH buckets of its bands, maintained by duplicates.py
+question_signature_table = Table(
+    'question_signatures',
+    Base.metadata,
+    Column('question_id', ForeignKey("questions.id"), primary_key=True),
+    Column('signature', LargeBinary, nullable=False),
+)
+
+# every lookup goes by bucket, including deletes, which recompute the buckets from the signature
+question_band_table = Table(
+    'question_bands',
+    Base.metadata,
+    Column('bucket', Integer, primary_key=True),
+    Column('question_id', ForeignKey("questions.id"), primary_key=True),
+    sqlite_with_rowid=False,
+)
+
+
+def new_token_version():
+    # random rather than counted, so a user that gets the id of a deleted one doesn't accept its tokens
+    return _secrets.randbits(62)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -29,6 +56,7 @@ class User(Base):
     name = Column(String, default="")
     hashed_password = Column(String)
     role_id = Column(Integer, ForeignKey("roles.id"), default=1)
+    token_version = Column(Integer, nullable=False, default=new_token_version)
 
     role = relationship("Role", back_populates="users")
     tests = relationship("Test", back_populates="user")
@@ -56,8 +84,9 @@ class Teacher(Base):
 
 class Theme(Base):
     __tablename__ = "themes"
+    __table_args__ = (Index('ix_themes_subject_id_name', 'subject_id', 'name', unique=True),)
     id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
     description = Column(String, nullable=False)
     subject_id = Column(Integer, ForeignKey("subjects.id"))
 
@@ -78,7 +107,9 @@ class Test(Base):
     __tablename__ = "tests"
     id = Column(Integer, primary_key=True)
     date = Column(DateTime, default=_dt.datetime.utcnow)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    # the worker whose pool holds the test until a user claims it, see test_pool.py
+    pool_owner = Column(String)
 
     user = relationship("User", back_populates="tests")
     answers = relationship("Answer", back_populates="test")
@@ -87,6 +118,10 @@ class Test(Base):
 
 class Question(Base):
     __tablename__ = "questions"
+    __table_args__ = (
+        Index('ix_questions_theme_id_text', 'theme_id', 'text', unique=True),
+        Index('ix_questions_theme_id', 'theme_id'),
+    )
     id = Column(Integer, primary_key=True)
     answer = Column(String, nullable=False)
     text = Column(String, nullable=False)
@@ -100,6 +135,10 @@ class Question(Base):
 
 class Answer(Base):
     __tablename__ = "answers"
+    __table_args__ = (
+        Index('ix_answers_test_id_question_id', 'test_id', 'question_id', unique=True),
+        Index('ix_answers_question_id', 'question_id'),
+    )
     id = Column(Integer, primary_key=True)
     given_answer = Column(String, default="")
     mark = Column(Integer, nullable=False)
@@ -108,3 +147,19 @@ class Answer(Base):
 
     question = relationship("Question", back_populates="answers")
     test = relationship("Test", back_populates="answers")
+
+
+class UserThemeStats(Base):
+    __tablename__ = "user_theme_stats"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    theme_id = Column(Integer, ForeignKey("themes.id"), primary_key=True)
+    mark_sum = Column(Float, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_attempt = Column(DateTime, default=_dt.datetime.utcnow)
+
+
+class QuestionStats(Base):
+    __tablename__ = "question_stats"
+    question_id = Column(Integer, ForeignKey("questions.id"), primary_key=True)
+    mark_sum = Column(Float, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
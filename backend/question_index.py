@@ -0,0 +1,51 @@
+import array as _array
+import random as _random
+import threading as _threading
+
+
+class QuestionIndex:
+    """Ids of the questions of every theme, kept in memory so tests can be sampled without ORDER BY RANDOM().
+
+    The index is filled from the database on first use. Before every sample the services read the questions
+    added since, by any process, with extend(), and drop the ones found deleted with retain().
+    Ids are stored in compact arrays, so a million questions take about 8 MB. The test pool's refill thread
+    samples and extends the index while the requests do, so every method holds a lock.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        # the index holds every question up to this id
+        self.max_id = 0
+        self._lock = _threading.RLock()
+
+    def load(self, rows):
+        with self._lock:
+            self._ids = {}
+            self.max_id = 0
+            self.extend(rows)
+
+    def extend(self, rows):
+        """Adds the (question id, theme id) rows, in id order, of the questions newer than max_id."""
+        with self._lock:
+            for question_id, theme_id in rows:
+                if question_id > self.max_id:
+                    self._ids.setdefault(theme_id, _array.array('q')).append(question_id)
+                    self.max_id = question_id
+
+    def remove(self, theme_id: int, question_id: int):
+        with self._lock:
+            ids = self._ids.get(theme_id, ())
+
+            if question_id in ids:
+                ids.remove(question_id)
+
+    def retain(self, theme_id: int, question_ids: set):
+        """Drops the theme's questions that aren't in ``question_ids``."""
+        with self._lock:
+            if theme_id in self._ids:
+                self._ids[theme_id] = _array.array('q', (i for i in self._ids[theme_id] if i in question_ids))
+
+    def sample(self, theme_id: int, amount: int):
+        with self._lock:
+            ids = self._ids.get(theme_id, ())
+            return _random.sample(ids, min(amount, len(ids)))
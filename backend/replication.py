@@ -0,0 +1,60 @@
+"""Stand-in for database replication when the primary and the replica are both SQLite files.
+
+A background thread copies the primary onto the replica with SQLite's online backup API every
+SQLITE_REPLICATION_INTERVAL seconds, so the replica lags the primary by at most about that long,
+like an asynchronous replica would. Every copy transfers the whole file, which is fine for local
+testing but not meant for production. To run it next to the app:
+
+    REPLICA_DATABASE_URL=sqlite:///./replica.db SQLITE_REPLICATION_INTERVAL=1 uvicorn main:app
+
+or on its own, copying once:
+
+    python replication.py sqlite:///./database.db sqlite:///./replica.db
+"""
+import os as _os
+import sqlite3 as _sqlite3
+import sys as _sys
+import threading as _threading
+
+import sqlalchemy.engine as _engine
+
+SQLITE_REPLICATION_INTERVAL = _os.environ.get("SQLITE_REPLICATION_INTERVAL")
+
+
+def replicate(source_url: str, target_url: str):
+    source = _sqlite3.connect(_engine.make_url(source_url).database)
+    target = _sqlite3.connect(_engine.make_url(target_url).database, timeout=30)
+
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+class SqliteReplicator:
+    def __init__(self, source_url: str, target_url: str, interval: float):
+        self.source_url = source_url
+        self.target_url = target_url
+        self.interval = interval
+        self._stopped = _threading.Event()
+        self._thread = _threading.Thread(target=self._run, name="sqlite-replication", daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                replicate(self.source_url, self.target_url)
+            except _sqlite3.Error as error:
+                print(f'Replication failed: {error}')
+
+    def start(self):
+        replicate(self.source_url, self.target_url)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+if __name__ == "__main__":
+    replicate(*_sys.argv[1:3])
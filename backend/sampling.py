@@ -0,0 +1,265 @@
+"""Weighted question sampling for adaptive tests, with one alias table per theme.
+
+A question's base weight comes from its difficulty: MIN_WEIGHT plus the share of marks missed over all
+answers to it, pulled towards PRIOR_SCORE while it has few answers, so the hardest questions are drawn
+three times as often as the easiest. A student's own answers then scale the weights of the questions
+they have answered by student_factor(): a question they got entirely wrong comes up 3.25 times as often,
+one they got right a quarter as often.
+
+The base weights of a theme are turned into an alias table (Walker's method), which takes O(n) to build
+and draws in O(1). Tables are built on first use and rebuilt only for the themes that changed: right
+away when a question is added or removed, at most every REBUILD_INTERVAL seconds when only answers moved
+the weights. The student's factors are applied per draw, from a small alias table of the questions they
+should see more often and by rejecting draws of the questions they should see less often, so a test
+costs O(amount + the student's answers in the theme) whatever the size of the theme.
+"""
+import array as _array
+import bisect as _bisect
+import random as _random
+import threading as _threading
+import time as _time
+
+MIN_WEIGHT = 0.5
+PRIOR_SCORE = 0.5
+PRIOR_ATTEMPTS = 5
+
+SEEN_WEIGHT = 0.25
+ERROR_WEIGHT = 3
+
+REBUILD_INTERVAL = 60
+# draws per question of a test before the rest is filled uniformly, for themes dominated by a few weights
+MAX_DRAWS = 20
+
+
+def base_weight(mark_sum: float, attempts: int):
+    """Weight of a question whose answers scored ``mark_sum`` out of ``attempts`` (marks over max_mark)."""
+    score = (mark_sum + PRIOR_SCORE * PRIOR_ATTEMPTS) / (attempts + PRIOR_ATTEMPTS)
+    return MIN_WEIGHT + 1 - min(max(score, 0), 1)
+
+
+def student_factor(score: float):
+    """Multiplier of a question the student answered with an average ``score`` (mark over max_mark)."""
+    return SEEN_WEIGHT + ERROR_WEIGHT * (1 - min(max(score, 0), 1))
+
+
+class AliasTable:
+    """Draws index i with probability weights[i] / total in O(1); weights must be positive."""
+
+    def __init__(self, weights):
+        self.weights = _array.array('d', weights)
+        self.total = sum(self.weights)
+        size = len(self.weights)
+
+        self._probabilities = _array.array('d', bytes(8 * size))
+        self._aliases = _array.array('q', range(size))
+
+        scaled = [weight * size / self.total for weight in self.weights]
+        small = [i for i, value in enumerate(scaled) if value < 1]
+        large = [i for i, value in enumerate(scaled) if value >= 1]
+
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self._probabilities[less] = scaled[less]
+            self._aliases[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+
+        # what is left is 1 up to rounding
+        for i in small + large:
+            self._probabilities[i] = 1
+
+    def __len__(self):
+        return len(self.weights)
+
+    def draw(self):
+        value = _random.random() * len(self.weights)
+        i = int(value)
+
+        return i if value - i < self._probabilities[i] else self._aliases[i]
+
+
+class _Theme:
+    def __init__(self):
+        self.ids = _array.array('q')
+        self.mark_sums = _array.array('d')
+        self.attempts = _array.array('q')
+        self.table = None
+        self.built_at = 0
+        self.changed = False
+
+    def position(self, question_id: int):
+        """Index of ``question_id`` in ids, which stay sorted since ids only grow, or None."""
+        i = _bisect.bisect_left(self.ids, question_id)
+        return i if i < len(self.ids) and self.ids[i] == question_id else None
+
+    def current_table(self):
+        if self.table is None or self.changed and _time.monotonic() - self.built_at >= REBUILD_INTERVAL:
+            self.table = AliasTable(map(base_weight, self.mark_sums, self.attempts))
+            self.built_at = _time.monotonic()
+            self.changed = False
+
+        return self.table
+
+
+class QuestionWeights:
+    """The base weights of every theme's questions, filled from the database on first use and then kept up to
+    date by the question and answer services, which also add the questions other processes inserted with
+    extend(). The test pool's refill thread drops deleted questions while the requests draw, so every method
+    but sampler() holds a lock.
+    """
+
+    def __init__(self):
+        self._themes = {}
+        self.loaded = False
+        # every question up to this id is in the weights
+        self.max_id = 0
+        self._lock = _threading.RLock()
+
+    def load(self, questions, stats):
+        """Takes (question id, theme id) rows and (question id, mark_sum, attempts) rows of question_stats."""
+        stats = {question_id: (mark_sum, attempts) for question_id, mark_sum, attempts in stats}
+        questions = sorted(questions)
+        themes = {}
+
+        for question_id, theme_id in questions:
+            theme = themes.setdefault(theme_id, _Theme())
+            mark_sum, attempts = stats.get(question_id, (0, 0))
+            theme.ids.append(question_id)
+            theme.mark_sums.append(mark_sum)
+            theme.attempts.append(attempts)
+
+        with self._lock:
+            self._themes = themes
+            self.max_id = questions[-1][0] if questions else 0
+            self.loaded = True
+
+    def extend(self, questions):
+        """Adds the (question id, theme id) rows, in id order, of the questions newer than max_id."""
+        with self._lock:
+            for question_id, theme_id in questions:
+                if question_id > self.max_id:
+                    theme = self._themes.setdefault(theme_id, _Theme())
+                    theme.ids.append(question_id)
+                    theme.mark_sums.append(0)
+                    theme.attempts.append(0)
+                    theme.table = None
+                    self.max_id = question_id
+
+    def remove(self, theme_id: int, question_id: int):
+        with self._lock:
+            theme = self._themes.get(theme_id)
+            i = None if theme is None else theme.position(question_id)
+
+            if i is not None:
+                del theme.ids[i], theme.mark_sums[i], theme.attempts[i]
+                theme.table = None
+
+    def retain(self, theme_id: int, question_ids: set):
+        """Drops the theme's questions that aren't in ``question_ids``."""
+        with self._lock:
+            theme = self._themes.get(theme_id)
+
+            if theme is not None:
+                kept = [i for i, question_id in enumerate(theme.ids) if question_id in question_ids]
+                theme.ids = _array.array('q', (theme.ids[i] for i in kept))
+                theme.mark_sums = _array.array('d', (theme.mark_sums[i] for i in kept))
+                theme.attempts = _array.array('q', (theme.attempts[i] for i in kept))
+                theme.table = None
+
+    def record(self, theme_id: int, question_id: int, mark_sum: float, attempts: int):
+        """Adds answers to a question, as in question_stats."""
+        with self._lock:
+            theme = self._themes.get(theme_id)
+            i = None if theme is None else theme.position(question_id)
+
+            if i is not None:
+                theme.mark_sums[i] += mark_sum
+                theme.attempts[i] += attempts
+                theme.changed = True
+
+    def weights(self, theme_id: int, scores: dict = None):
+        """What sample() draws from: (question id, base weight, student factor, weight) for every question of
+        the theme, in id order, given the student's average score per question in ``scores``.
+        """
+        with self._lock:
+            theme = self._themes.get(theme_id)
+            if theme is None or not theme.ids:
+                return []
+
+            scores = scores or {}
+            result = []
+
+            for question_id, weight in zip(theme.ids, theme.current_table().weights):
+                factor = student_factor(scores[question_id]) if question_id in scores else 1
+                result.append((question_id, weight, factor, weight * factor))
+
+            return result
+
+    def sampler(self, theme_id: int, scores: dict = None):
+        """A Sampler of the theme for a student with the given average score per question, or None if the theme
+        has no questions.
+        """
+        theme = self._themes.get(theme_id)
+
+        return None if theme is None or not theme.ids else Sampler(theme, scores or {})
+
+    def sample(self, theme_id: int, amount: int, scores: dict = None):
+        """Up to ``amount`` distinct question ids of the theme, each draw weighted as weights() says."""
+        with self._lock:
+            sampler = self.sampler(theme_id, scores)
+
+            return [] if sampler is None else sampler.sample(amount)
+
+
+class Sampler:
+    """Draws the questions of one theme for one student."""
+
+    def __init__(self, theme: _Theme, scores: dict):
+        self._theme = theme
+        self._table = theme.current_table()
+        self._scores = scores
+
+        # the part of a boosted question's weight beyond its base weight is drawn from a table of its own
+        self._boosted, extra_weights = [], []
+        for question_id, score in scores.items():
+            i = theme.position(question_id)
+            factor = student_factor(score)
+
+            if i is not None and factor > 1:
+                self._boosted.append(question_id)
+                extra_weights.append(self._table.weights[i] * (factor - 1))
+
+        self._extra = AliasTable(extra_weights) if self._boosted else None
+        self._extra_share = self._extra.total / (self._extra.total + self._table.total) if self._boosted else 0
+
+    def draw(self):
+        """One question id, or None for a rejected draw of a question the student should see less often."""
+        if _random.random() < self._extra_share:
+            return self._boosted[self._extra.draw()]
+
+        question_id = self._theme.ids[self._table.draw()]
+        factor = student_factor(self._scores[question_id]) if question_id in self._scores else 1
+
+        return None if factor < 1 and _random.random() >= factor else question_id
+
+    def sample(self, amount: int):
+        ids = self._theme.ids
+
+        if amount >= len(ids):
+            return _random.sample(ids, len(ids))
+
+        chosen = {}
+
+        for _ in range(amount * MAX_DRAWS):
+            if len(chosen) == amount:
+                break
+
+            question_id = self.draw()
+            if question_id is not None:
+                chosen[question_id] = None
+
+        if len(chosen) < amount:
+            rest = [question_id for question_id in ids if question_id not in chosen]
+            chosen.update(dict.fromkeys(_random.sample(rest, amount - len(chosen))))
+
+        return list(chosen)
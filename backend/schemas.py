@@ -1,7 +1,10 @@
 import datetime as _dt
-from typing import List, Tuple
+from typing import Generic, List, Optional, Tuple, TypeVar
 
 import pydantic as _pydantic
+import pydantic.generics as _generics
+
+_T = TypeVar('_T')
 
 
 # ----------------BASE-MODELS------------------
@@ -80,6 +83,11 @@ class User(_UserBase):
     role_id: int
 
 
+class Principal(User):
+    role: str
+    version: int
+
+
 # ------------------------TEACHER-MODELS------------------------------
 class Teacher(_TeacherBase):
     id: int
@@ -90,6 +98,10 @@ class TeacherCreate(_TeacherBase):
     theme_ids: List[int]
 
 
+class TeacherRecommendation(Teacher):
+    score: float
+
+
 # ----------------------------THEME-MODELS-----------------------------
 class ThemeCreate(_ThemeBase):
     pass
@@ -99,7 +111,6 @@ class Theme(_ThemeBase):
     id: int
     teachers: List[_TeacherBase]
     subject: _SubjectBase
-    questions: List[_QuestionBase]
 
 
 # ------------------------------SUBJECT-MODELS---------------------------
@@ -120,6 +131,36 @@ class Question(_QuestionBase):
     theme: _ThemeBase
 
 
+class QuestionImport(QuestionCreate):
+    id: int = 0
+    theme_id: Optional[int] = None
+    subject: Optional[str] = None
+    theme: Optional[str] = None
+
+
+class ImportRowError(_pydantic.BaseModel):
+    line: int
+    error: str
+
+
+class ImportReport(_pydantic.BaseModel):
+    imported: int
+    errors: List[ImportRowError]
+
+
+class DuplicateCheck(_pydantic.BaseModel):
+    text: str
+
+
+class DuplicateCandidate(_pydantic.BaseModel):
+    question: Question
+    similarity: float
+
+
+class DuplicateCluster(_pydantic.BaseModel):
+    question_ids: List[int]
+
+
 # --------------------------------ANSWER-MODELS---------------------------
 class Answer(_AnswerBase):
     pass
@@ -133,6 +174,11 @@ class AnswerCreate(_AnswerBase):
     pass
 
 
+class AnswerSubmit(_pydantic.BaseModel):
+    question_id: int
+    given_answer: str
+
+
 # --------------------------------TEST-MODELS-----------------------------
 class Test(_TestBase):
     questions: List[_QuestionBase]
@@ -141,3 +187,21 @@ class Test(_TestBase):
 class TestCompleted(Test):
     answers: List[AnswerComplete]
 
+
+class QuestionWeight(_pydantic.BaseModel):
+    question_id: int
+    base_weight: float
+    student_factor: float
+    weight: float
+    probability: float
+
+
+# --------------------------------PAGINATION-MODELS-----------------------------
+class Page(_generics.GenericModel, Generic[_T]):
+    items: List[_T]
+    next_cursor: Optional[int] = None
+
+
+class SearchPage(Page[Question]):
+    # more questions match than the search ranks (search.MAX_RANKED), and the rest can't be paged to
+    truncated: bool = False
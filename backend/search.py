@@ -0,0 +1,113 @@
+"""Full-text search over the question bank, backed by an SQLite FTS5 table.
+
+question_search holds the text of every question with the name and description of its theme, keyed by
+the question id. Triggers on questions and themes keep it in sync with every insert, update and
+delete, whether it comes from the services, db_startup.py or plain SQL. The table and triggers are
+created together with the questions table; migrations.py adds them to an existing database.
+"""
+import re as _re
+
+import sqlalchemy as _sql
+import sqlalchemy.event as _event
+
+import models as _models
+
+TABLE = "question_search"
+
+# relative weight of a match in the question text, the theme name and the theme description
+WEIGHTS = (4.0, 2.0, 1.0)
+# matches ranked per search, lowest ids first, so a word most questions contain doesn't rank the whole bank;
+# the search tells when a query has more
+MAX_RANKED = 1000
+
+_INDEX_QUESTIONS = f"""
+    INSERT INTO {TABLE} (rowid, text, theme_name, theme_description)
+    SELECT questions.id, questions.text, themes.name, themes.description
+    FROM questions LEFT JOIN themes ON themes.id = questions.theme_id
+"""
+
+DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(
+        text, theme_name, theme_description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS questions_search_insert AFTER INSERT ON questions BEGIN
+        {_INDEX_QUESTIONS} WHERE questions.id = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS questions_search_update AFTER UPDATE OF text, theme_id ON questions BEGIN
+        DELETE FROM {TABLE} WHERE rowid = old.id;
+        {_INDEX_QUESTIONS} WHERE questions.id = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS questions_search_delete AFTER DELETE ON questions BEGIN
+        DELETE FROM {TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS themes_search_update AFTER UPDATE OF name, description ON themes BEGIN
+        UPDATE {TABLE} SET theme_name = new.name, theme_description = new.description
+        WHERE rowid IN (SELECT id FROM questions WHERE theme_id = new.id);
+    END
+    """,
+]
+
+
+def create(connection):
+    for statement in DDL:
+        connection.execute(_sql.text(statement))
+
+
+def rebuild(connection):
+    """Refills question_search from the questions and themes tables."""
+    connection.execute(_sql.text(f"DELETE FROM {TABLE}"))
+    connection.execute(_sql.text(_INDEX_QUESTIONS))
+
+
+@_event.listens_for(_models.Question.__table__, "after_create")
+def _create_with_questions(target, connection, **kwargs):
+    if connection.dialect.name == "sqlite":
+        create(connection)
+
+
+def match_query(query: str):
+    """Turns user input into an FTS5 query matching every word as a prefix, or None if it has no words."""
+    words = _re.findall(r"\w+", query)
+
+    if not words:
+        return None
+
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_statement(theme_id: int = None):
+    """Ids of the questions matching :match, best match first, paged by :limit and :offset, each with whether
+    there were more matches than the MAX_RANKED first ones that get ranked, so a word that most of the bank
+    contains doesn't make bm25 score all of it.
+    """
+    # CROSS JOIN keeps the tables in this order: the FTS table filtered by the bound, and then the theme
+    tables = f"{TABLE}"
+
+    if theme_id is not None:
+        tables += f" CROSS JOIN questions ON questions.id = {TABLE}.rowid AND questions.theme_id = :theme_id"
+
+    matches = f"{TABLE} MATCH :match"
+
+    # FTS5 returns matches in rowid order and takes a rowid bound as a constraint of its own; the first match
+    # beyond MAX_RANKED is both the bound and the sign there are more
+    return _sql.text(f"""
+        SELECT {TABLE}.rowid AS id, beyond.id IS NOT NULL AS truncated
+        FROM (
+            SELECT (
+                SELECT {TABLE}.rowid FROM {tables} WHERE {matches} ORDER BY {TABLE}.rowid LIMIT 1 OFFSET {MAX_RANKED}
+            ) AS id
+        ) AS beyond
+        CROSS JOIN {tables}
+        WHERE {matches} AND {TABLE}.rowid < coalesce(beyond.id, {2 ** 63 - 1})
+        ORDER BY bm25({TABLE}, {", ".join(map(str, WEIGHTS))}), {TABLE}.rowid
+        LIMIT :limit OFFSET :offset
+    """)
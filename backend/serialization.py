@@ -0,0 +1,36 @@
+import json as _json
+import os as _os
+
+import fastapi as _fastapi
+import fastapi.encoders as _encoders
+import pydantic as _pydantic
+
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+ENCODER = "json" if _orjson is None else "orjson"
+
+# Set FAST_RESPONSES=1 to serve the question and teacher listings as plain rows read straight from the query,
+# skipping pydantic validation of data the server built itself
+FAST_RESPONSES = _os.environ.get("FAST_RESPONSES", "0") == "1"
+
+
+def _default(obj):
+    if isinstance(obj, _pydantic.BaseModel):
+        return _encoders.jsonable_encoder(obj)
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """Encodes ``content`` as compact UTF-8 JSON, with orjson when it is installed."""
+    if _orjson is not None:
+        return _orjson.dumps(content, default=_default)
+
+    return _json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def response(content, status_code: int = 200):
+    return _fastapi.Response(content=dumps(content), status_code=status_code, media_type="application/json")
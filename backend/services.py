@@ -1,24 +1,61 @@
+import asyncio as _asyncio
+import collections as _collections
+import csv as _csv
 import database as _database
 import datetime as _dt
+import hashlib as _hashlib
+import inspect as _inspect
+import io as _io
+import json as _json
+import time as _time
+import sqlalchemy as _sql
+import sqlalchemy.dialects.postgresql as _postgresql
+import sqlalchemy.dialects.sqlite as _sqlite
 import sqlalchemy.orm as _orm
-import models as _models, schemas as _schemas
-import passlib.hash as _hash
+import models as _models, schemas as _schemas, hashing as _hashing, cache as _cache
+import question_index as _question_index, grading as _grading, loading as _loading
+import serialization as _serialization, search as _search, duplicates as _duplicates, importing as _importing
+import sampling as _sampling, test_pool as _test_pool
 import jwt as _jwt
 import fastapi as _fastapi
 import fastapi.security as _security
-from sqlalchemy.sql.functions import random as _random
 from typing import List
 
 oauth2schema = _security.OAuth2PasswordBearer(tokenUrl="/api/token")
 
 JWT_SECRET = "string incedent"
 
+# token_version of recently seen users, so authenticated requests skip the users table
+PRINCIPAL_TTL = 60
+_principal_versions = _cache.TTLCache(ttl=PRINCIPAL_TTL, maxsize=10000)
+
+_questions_by_theme = _question_index.QuestionIndex()
+# difficulty weights of adaptive tests, loaded on the first adaptive test
+_question_weights = _sampling.QuestionWeights()
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# serialized subject, theme and teacher listings; cleared whenever one of them changes
+CATALOG_TTL = 300
+_catalog = _cache.TTLCache(ttl=CATALOG_TTL, maxsize=1024)
+
+# answer keys of recently graded questions; a question edited by another worker is graded with its old
+# answer for at most ANSWER_KEY_TTL seconds
+ANSWER_KEY_TTL = 60
+ANSWER_KEY_CACHE_SIZE = 100000
+_answer_keys = _grading.AnswerKeyCache(ttl=ANSWER_KEY_TTL, maxsize=ANSWER_KEY_CACHE_SIZE)
+
 
 # ---------------------------MISC-----------------------------------
+def _check_admin(user: _schemas.Principal):
+    if not is_admin(user):
+        raise _fastapi.HTTPException(status_code=401, detail='Must be an admin to perform this action')
+
+
 def require_admin(func):
-    async def wrapped(current_user: _schemas.User, *args, **kwargs):
-        if not is_admin(current_user):
-            raise _fastapi.HTTPException(status_code=401, detail='Must be an admin to perform this action')
+    async def wrapped(current_user: _schemas.Principal, *args, **kwargs):
+        _check_admin(current_user)
 
         return await func(*args, **kwargs)
 
@@ -32,38 +69,50 @@ def get_amounts(question_amount: int, theme_amount: int):
     return amounts
 
 
-async def get_worst_themes(tests: List[_models.Test], db: _orm.Session):
-    result = {}
+async def get_theme_scores(user_id: int, db: _orm.Session, amount: int = None):
+    """Average mark / max_mark of the user's answers per theme name, weakest first."""
+    score = _sql.func.sum(_models.UserThemeStats.mark_sum) / _sql.func.sum(_models.UserThemeStats.attempts)
 
-    for test in tests:
+    rows = await _run(db.execute(
+        _sql.select(_models.Theme.name, score)
+        .join(_models.Theme, _models.UserThemeStats.theme_id == _models.Theme.id)
+        .filter(_models.UserThemeStats.user_id == user_id)
+        .group_by(_models.Theme.name)
+        .order_by(score, _models.Theme.name)
+        .limit(amount)
+    ))
 
-        for (answer, question) in zip(test.answers, test.questions):
-            theme = db.query(_models.Theme).filter_by(id=question.theme_id).first()
+    return rows.all()
 
-            mark = answer.mark / question.max_mark
 
-            if theme.name in result.keys():
-                amount = result[theme.name][1]
-                summ = result[theme.name][0]
-                result[theme.name] = (summ + mark, amount + 1)
-            else:
-                result[theme.name] = (mark, 1)
+async def get_worst_themes(user_id: int, db: _orm.Session, amount: int = 3):
+    return [name for (name, _) in await get_theme_scores(user_id, db, amount)]
 
-    for key in result.keys():
-        result[key] = result[key][0] / result[key][1]
 
-    result = list(sorted(result.items(), key=lambda item: item[1]))
+async def get_catalog_response(key, load):
+    """Returns the ETag and JSON body of a catalog response, awaiting load() only when it is not cached."""
+    response = _catalog.get(key)
 
-    if len(result) > 3:
-        result = result[:3]
+    if response is None:
+        generation = _catalog.generation
+        body = _serialization.dumps(await load())
+        response = ('"' + _hashlib.sha1(body).hexdigest() + '"', body)
 
-    result = [x[0] for x in result]
+        # a replica may not have the change that cleared the cache yet
+        replicated = _time.monotonic() - _catalog.cleared_at >= _database.REPLICA_MAX_LAG
 
-    return result
+        if generation == _catalog.generation and replicated:
+            _catalog.set(key, response)
+
+    return response
+
+
+def invalidate_catalog():
+    _catalog.clear()
 
 
 # -----------------------DATABASE-FUNCTIONS-------------------------
-def get_db():
+def get_sync_db():
     db = _database.SessionLocal()
     try:
         yield db
@@ -71,13 +120,88 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with _database.AsyncSessionLocal() as db:
+        yield db
+
+
+get_db = get_async_db if _database.USE_ASYNC_DATABASE else get_sync_db
+
+
+def get_sync_read_db():
+    db = _database.ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    async with _database.AsyncReplicaSessionLocal() as db:
+        yield db
+
+
+# session for endpoints that only read; bound to the replica when REPLICA_DATABASE_URL is set
+get_read_db = get_async_read_db if _database.USE_ASYNC_DATABASE else get_sync_read_db
+
+
+async def in_worker_thread(coroutine):
+    """Runs ``coroutine`` on an event loop of its own in a worker thread, so bulk or CPU-heavy work doesn't hold up
+    every other request. It must use a sync session (get_sync_db), as those aren't tied to an event loop.
+    """
+    loop = _asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _asyncio.run, coroutine)
+
+
+def create_database():
+    return _database.Base.metadata.create_all(bind=_database.engine)
+
+
+async def _run(result):
+    """Awaits the result of a session call when the session is an AsyncSession."""
+    if _inspect.isawaitable(result):
+        return await result
+
+    return result
+
+
+async def _page(db: _orm.Session, statement, model, schema, cursor: int, limit: int):
+    """Loads the ``limit`` rows of ``statement`` that follow id ``cursor``, ordered by id."""
+    if cursor is not None:
+        statement = statement.filter(model.id > cursor)
+
+    rows = await _all(db, statement.order_by(model.id).limit(limit + 1))
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+
+    return _schemas.Page[schema](items=list(map(schema.from_orm, rows[:limit])), next_cursor=next_cursor)
+
+
+async def _row_page(db: _orm.Session, statement, id_column, cursor: int, limit: int):
+    """Like _page, but returns the plain result rows, which must have an ``id`` column, and the next cursor."""
+    if cursor is not None:
+        statement = statement.filter(id_column > cursor)
+
+    rows = (await _run(db.execute(statement.order_by(id_column).limit(limit + 1)))).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+
+    return rows[:limit], next_cursor
+
+
+async def _first(db: _orm.Session, statement):
+    return (await _run(db.execute(statement))).scalars().first()
+
+
+async def _all(db: _orm.Session, statement):
+    return (await _run(db.execute(statement))).scalars().all()
+
+
 # ------------------------USER-AND-LOGIN-FUNCTIONS-------------------------------
-async def get_user_by_email(email: str, db: _orm.Session):
-    return db.query(_models.User).filter(_models.User.email == email).first()
+async def get_user_by_email(email: str, db: _orm.Session, options=()):
+    return await _first(db, _sql.select(_models.User).options(*options).filter(_models.User.email == email))
 
 
-async def _user_selector(user_id: int, db: _orm.Session):
-    user = db.query(_models.User).filter_by(id=user_id).first()
+async def _user_selector(user_id: int, db: _orm.Session, options=()):
+    user = await _first(db, _sql.select(_models.User).options(*options).filter_by(id=user_id))
 
     if user is None:
         raise _fastapi.HTTPException(status_code=404, detail="User does not exist")
@@ -94,28 +218,27 @@ async def _user_selector_change(user_id, db: _orm.Session, current_user: _schema
     return user
 
 
-def is_admin(user: _schemas.User, db: _orm.Session = next(get_db())):
-    user_db = db.query(_models.User).filter_by(email=user.email).first()
-    return user_db.role.name == 'administrator'
+def is_admin(user: _schemas.Principal):
+    return user.role == 'administrator'
 
 
 async def create_user(user: _schemas.UserCreate, db: _orm.Session):
-    user_obj = _models.User(email=user.email, name=user.name, hashed_password=_hash.bcrypt.hash(user.hashed_password))
+    hashed_password = await _hashing.hash_password(user.hashed_password)
+    user_obj = _models.User(email=user.email, name=user.name, hashed_password=hashed_password)
 
     db.add(user_obj)
-    db.commit()
-    db.refresh(user_obj)
+    await _run(db.commit())
 
-    return user_obj
+    return await _user_selector(user_obj.id, db, _loading.PRINCIPAL)
 
 
 async def authenticate_user(email: str, password: str, db: _orm.Session):
-    user = await get_user_by_email(email, db)
+    user = await get_user_by_email(email, db, _loading.PRINCIPAL)
 
     if not user:
         return False
 
-    if not user.verify_password(password):
+    if not await _hashing.verify_password(password, user.hashed_password):
         return False
 
     return user
@@ -123,27 +246,52 @@ async def authenticate_user(email: str, password: str, db: _orm.Session):
 
 async def create_token(user: _models.User):
 
-    data = {'name': user.name, 'email': user.email, 'password': user.hashed_password}
+    data = {
+        'id': user.id,
+        'name': user.name,
+        'email': user.email,
+        'role_id': user.role_id,
+        'role': user.role.name,
+        'version': user.token_version,
+    }
 
     token = _jwt.encode(data, JWT_SECRET)
 
     return dict(access_token=token, token_type="bearer")
 
 
+async def _token_version(user_id: int, db: _orm.Session):
+    version = _principal_versions.get(user_id)
+
+    if version is None:
+        version = await _first(db, _sql.select(_models.User.token_version).filter_by(id=user_id))
+        _principal_versions.set(user_id, version)
+
+    return version
+
+
 async def get_current_user(db: _orm.Session = _fastapi.Depends(get_db), token: str = _fastapi.Depends(oauth2schema)):
     try:
         payload = _jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        user = db.query(_models.User).filter_by(email=payload["email"]).first()
+        user = _schemas.Principal.parse_obj(payload)
     except:
         raise _fastapi.HTTPException(status_code=401, detail="Invalid Credentials")
 
-    return _schemas.User.from_orm(user)
+    if await _token_version(user.id, db) != user.version:
+        raise _fastapi.HTTPException(status_code=401, detail="Invalid Credentials")
+
+    return user
+
+
+async def get_current_admin(current_user: _schemas.Principal = _fastapi.Depends(get_current_user)):
+    """get_current_user for the endpoints only admins may call."""
+    _check_admin(current_user)
 
+    return current_user
 
-async def get_users(db: _orm.Session):
-    users = db.query(_models.User).all()
 
-    return list(map(_schemas.User.from_orm, users))
+async def get_users(db: _orm.Session, cursor: int = None, limit: int = PAGE_SIZE):
+    return await _page(db, _sql.select(_models.User), _models.User, _schemas.User, cursor, limit)
 
 
 async def get_user(user_id: int, db: _orm.Session):
@@ -155,8 +303,11 @@ async def get_user(user_id: int, db: _orm.Session):
 async def delete_user(user_id: int, current_user: _schemas.User, db: _orm.Session):
     user = await _user_selector_change(user_id, db, current_user)
 
-    db.delete(user)
-    db.commit()
+    await _run(db.delete(user))
+    await _run(db.execute(_sql.delete(_models.UserThemeStats).filter_by(user_id=user_id)))
+    await _run(db.commit())
+
+    _principal_versions.pop(user_id)
 
 
 async def update_user(user_id: int, user: _schemas.UserCreate, current_user: _schemas.User, db: _orm.Session):
@@ -164,21 +315,23 @@ async def update_user(user_id: int, user: _schemas.UserCreate, current_user: _sc
 
     old_user.name = user.name
     old_user.email = user.email
-    old_user.hashed_password = _hash.bcrypt.hash(user.hashed_password)
+    old_user.hashed_password = await _hashing.hash_password(user.hashed_password)
+    old_user.token_version = _models.new_token_version()
+
+    await _run(db.commit())
 
-    db.commit()
-    db.refresh(old_user)
+    _principal_versions.pop(user_id)
 
-    return _schemas.User.from_orm(old_user)
+    return await _user_selector(user_id, db, _loading.PRINCIPAL)
 
 
 # --------------------------------TEACHER-FUNCTIONS--------------------------
 async def get_teacher_by_phone(phone_number: str, db: _orm.Session):
-    return db.query(_models.Teacher).filter_by(phone_number=phone_number).first()
+    return await _first(db, _sql.select(_models.Teacher).filter_by(phone_number=phone_number))
 
 
 async def _teacher_selector(teacher_id: int, db: _orm.Session):
-    teacher = db.query(_models.Teacher).filter_by(id=teacher_id).first()
+    teacher = await _first(db, _sql.select(_models.Teacher).options(*_loading.TEACHER).filter_by(id=teacher_id))
 
     if teacher is None:
         raise _fastapi.HTTPException(status_code=404, detail='Teacher does not exist')
@@ -189,7 +342,8 @@ async def _teacher_selector(teacher_id: int, db: _orm.Session):
 async def _get_teacher_themes(theme_ids: List[int], db: _orm.Session):
     themes = []
 
-    for theme_id in theme_ids:
+    # a theme listed twice would break the unique teacher_theme index
+    for theme_id in dict.fromkeys(theme_ids):
         theme = await _simple_theme_selector(theme_id, db)
         themes.append(theme)
 
@@ -209,16 +363,47 @@ async def create_teacher(teacher: _schemas.TeacherCreate, db: _orm.Session):
     teacher_obj.themes = themes
 
     db.add(teacher_obj)
-    db.commit()
-    db.refresh(teacher_obj)
+    await _run(db.commit())
+
+    invalidate_catalog()
+
+    return await _teacher_selector(teacher_obj.id, db)
+
+
+async def get_teachers(db: _orm.Session, cursor: int = None, limit: int = PAGE_SIZE, theme_id: int = None):
+    teachers = _sql.select(_models.Teacher).options(*_loading.TEACHER)
+
+    if theme_id is not None:
+        association = _models.teacher_theme_association_table
+        teachers = teachers\
+            .join(association, association.c.teacher_id == _models.Teacher.id)\
+            .filter(association.c.theme_id == theme_id)
+
+    return await _page(db, teachers, _models.Teacher, _schemas.Teacher, cursor, limit)
 
-    return teacher_obj
 
+async def get_teacher_rows(db: _orm.Session, cursor: int = None, limit: int = PAGE_SIZE, theme_id: int = None):
+    """get_teachers as plain dicts, read with one query for the teachers and one for their themes."""
+    association = _models.teacher_theme_association_table
+    teachers = _sql.select(_models.Teacher.name, _models.Teacher.phone_number, _models.Teacher.id)
 
-async def get_teachers(db: _orm.Session):
-    teachers = db.query(_models.Teacher).all()
+    if theme_id is not None:
+        teachers = teachers\
+            .join(association, association.c.teacher_id == _models.Teacher.id)\
+            .filter(association.c.theme_id == theme_id)
 
-    return list(map(_schemas.Teacher.from_orm, teachers))
+    rows, next_cursor = await _row_page(db, teachers, _models.Teacher.id, cursor, limit)
+    items = [{'name': row.name, 'phone_number': row.phone_number, 'id': row.id, 'themes': []} for row in rows]
+    by_id = {item['id']: item for item in items}
+
+    themes = _sql.select(association.c.teacher_id, _models.Theme.id, _models.Theme.name, _models.Theme.description)\
+        .join(_models.Theme, _models.Theme.id == association.c.theme_id)\
+        .filter(association.c.teacher_id.in_(by_id))
+
+    for row in (await _run(db.execute(themes))).all():
+        by_id[row.teacher_id]['themes'].append({'id': row.id, 'name': row.name, 'description': row.description})
+
+    return {'items': items, 'next_cursor': next_cursor}
 
 
 async def get_teacher(teacher_id: int, db: _orm.Session):
@@ -230,8 +415,10 @@ async def get_teacher(teacher_id: int, db: _orm.Session):
 async def delete_teacher(teacher_id: int, user: _schemas.User, db: _orm.Session):
     teacher = await _teacher_selector_change(user, teacher_id, db)
 
-    db.delete(teacher)
-    db.commit()
+    await _run(db.delete(teacher))
+    await _run(db.commit())
+
+    invalidate_catalog()
 
 
 async def update_teacher(teacher_id: int, user: _schemas.User, db: _orm.Session, teacher: _schemas.TeacherCreate):
@@ -243,38 +430,60 @@ async def update_teacher(teacher_id: int, user: _schemas.User, db: _orm.Session,
     themes = await _get_teacher_themes(teacher.theme_ids, db)
     old_teacher.themes = themes
 
-    db.commit()
-    db.refresh(old_teacher)
+    await _run(db.commit())
+
+    invalidate_catalog()
+    old_teacher = await _teacher_selector(teacher_id, db)
 
     return _schemas.Teacher.from_orm(old_teacher)
 
 
-async def get_teacher_recommendations(tests: List[_models.Test], db: _orm.Session):
-    theme_names = await get_worst_themes(tests, db)
+async def get_teacher_recommendations(user_id: int, db: _orm.Session, amount: int = 3):
+    """Teachers ranked by how much of the user's weakness their themes cover.
+
+    Every theme the user answered weighs 1 - its average score, a teacher scores the sum of the weights
+    of the themes they teach, and the database keeps only the best ``amount`` teachers.
+    """
+    weights = {name: 1 - score for (name, score) in await get_theme_scores(user_id, db) if score < 1}
 
-    teachers = db.query(_models.Teacher)
+    if not weights:
+        return []
 
-    for theme_name in theme_names:
-        teachers = teachers.filter(_models.Teacher.themes.any(_models.Theme.name == theme_name))
+    teacher_id = _models.teacher_theme_association_table.c.teacher_id
+    score = _sql.func.sum(_sql.case(weights, value=_models.Theme.name))
 
-    teachers = teachers.all()
+    ranking = (await _run(db.execute(
+        _sql.select(teacher_id, score)
+        .join(_models.Theme, _models.teacher_theme_association_table.c.theme_id == _models.Theme.id)
+        .filter(_models.Theme.name.in_(weights))
+        .group_by(teacher_id)
+        .order_by(score.desc(), teacher_id)
+        .limit(amount)
+    ))).all()
 
-    teachers = teachers if len(teachers) <= 3 else teachers[:3]
+    teachers = await _all(
+        db,
+        _sql.select(_models.Teacher).options(*_loading.TEACHER).filter(_models.Teacher.id.in_([x[0] for x in ranking]))
+    )
+    teachers = {teacher.id: teacher for teacher in teachers}
 
-    return teachers
+    return [
+        _schemas.TeacherRecommendation(**_schemas.Teacher.from_orm(teachers[teacher_id]).dict(), score=score)
+        for (teacher_id, score) in ranking
+    ]
 
 
 # ----------------------------SUBJECT-FUNCTIONS-------------------------------
 async def get_subject_by_name(subject_name: str, db: _orm.Session):
-    return db.query(_models.Subject).filter_by(name=subject_name).first()
+    return await _first(db, _sql.select(_models.Subject).filter_by(name=subject_name))
 
 
 async def get_subject_by_id(subject_id: int, db: _orm.Session):
-    return db.query(_models.Subject).filter_by(id=subject_id).first()
+    return await _first(db, _sql.select(_models.Subject).filter_by(id=subject_id))
 
 
 async def _subject_selector(subject_id: int, db: _orm.Session):
-    subject = db.query(_models.Subject).filter_by(id=subject_id).first()
+    subject = await _first(db, _sql.select(_models.Subject).options(*_loading.SUBJECT).filter_by(id=subject_id))
 
     if subject is None:
         raise _fastapi.HTTPException(status_code=404, detail='Subject does not exist')
@@ -294,16 +503,17 @@ async def create_subject(subject: _schemas.SubjectCreate, db: _orm.Session):
     subject_obj = _models.Subject(name=subject.name)
 
     db.add(subject_obj)
-    db.commit()
-    db.refresh(subject_obj)
+    await _run(db.commit())
 
-    return subject_obj
+    invalidate_catalog()
 
+    return await _subject_selector(subject_obj.id, db)
 
-async def get_subjects(db: _orm.Session):
-    subjects = db.query(_models.Subject).all()
 
-    return list(map(_schemas.Subject.from_orm, subjects))
+async def get_subjects(db: _orm.Session, cursor: int = None, limit: int = PAGE_SIZE):
+    subjects = _sql.select(_models.Subject).options(*_loading.SUBJECT)
+
+    return await _page(db, subjects, _models.Subject, _schemas.Subject, cursor, limit)
 
 
 async def get_subject(subject_id: int, db: _orm.Session):
@@ -315,8 +525,11 @@ async def get_subject(subject_id: int, db: _orm.Session):
 async def delete_subject(subject_id: int, db: _orm.Session, user: _schemas.User):
     subject = await _subject_selector_change(user, subject_id, db)
 
-    db.delete(subject)
-    db.commit()
+    await _run(db.delete(subject))
+    await _run(db.commit())
+
+    invalidate_catalog()
+    pooled_tests.clear()
 
 
 async def update_subject(subject_id: int, db: _orm.Session, user: _schemas.User, subject: _schemas.SubjectCreate):
@@ -324,19 +537,24 @@ async def update_subject(subject_id: int, db: _orm.Session, user: _schemas.User,
 
     old_subject.name = subject.name
 
-    db.commit()
-    db.refresh(old_subject)
+    await _run(db.commit())
+
+    invalidate_catalog()
+    old_subject = await _subject_selector(subject_id, db)
 
     return _schemas.Subject.from_orm(old_subject)
 
 
 # ----------------------------------THEME-FUNCTIONS--------------------------
 async def get_theme_by_name(subject_id: int, theme_name: str, db: _orm.Session):
-    return db.query(_models.Theme).filter_by(name=theme_name, subject_id=subject_id).first()
+    return await _first(db, _sql.select(_models.Theme).filter_by(name=theme_name, subject_id=subject_id))
 
 
 async def _theme_selector(subject_id: int, theme_id: int, db: _orm.Session):
-    theme = db.query(_models.Theme).filter_by(id=theme_id, subject_id=subject_id).first()
+    theme = await _first(
+        db,
+        _sql.select(_models.Theme).options(*_loading.THEME).filter_by(id=theme_id, subject_id=subject_id)
+    )
 
     if theme is None:
         raise _fastapi.HTTPException(status_code=404, detail='Theme does not exist')
@@ -345,7 +563,7 @@ async def _theme_selector(subject_id: int, theme_id: int, db: _orm.Session):
 
 
 async def _simple_theme_selector(theme_id: int, db: _orm.Session):
-    theme = db.query(_models.Theme).filter_by(id=theme_id).first()
+    theme = await _first(db, _sql.select(_models.Theme).filter_by(id=theme_id))
 
     if theme is None:
         raise _fastapi.HTTPException(status_code=404, detail='Theme does not exist')
@@ -364,18 +582,20 @@ async def create_theme(subject_id: int, db: _orm.Session, theme: _schemas.ThemeC
     theme_obj = _models.Theme(name=theme.name, description=theme.description, subject=subject, subject_id=subject.id)
 
     db.add(theme_obj)
-    db.commit()
-    db.refresh(theme_obj)
+    await _run(db.commit())
+
+    invalidate_catalog()
 
-    return theme_obj
+    return await _theme_selector(subject_id, theme_obj.id, db)
 
 
-async def get_themes(subject_id: int, db: _orm.Session):
-    subject = _schemas.Subject.from_orm(await _subject_selector(subject_id, db))
+async def get_themes(subject_id: int, db: _orm.Session, cursor: int = None, limit: int = PAGE_SIZE):
+    if await get_subject_by_id(subject_id, db) is None:
+        raise _fastapi.HTTPException(status_code=404, detail='Subject does not exist')
 
-    themes = subject.themes
+    themes = _sql.select(_models.Theme).filter_by(subject_id=subject_id)
 
-    return themes
+    return await _page(db, themes, _models.Theme, _schemas._ThemeBase, cursor, limit)
 
 
 async def get_theme(subject_id: int, theme_id: int, db: _orm.Session):
@@ -385,8 +605,11 @@ async def get_theme(subject_id: int, theme_id: int, db: _orm.Session):
 async def delete_theme(subject_id: int, theme_id: int, db: _orm.Session, current_user: _schemas.User):
     theme = await _theme_selector_change(current_user, subject_id, theme_id, db)
 
-    db.delete(theme)
-    db.commit()
+    await _run(db.delete(theme))
+    await _run(db.commit())
+
+    invalidate_catalog()
+    pooled_tests.clear()
 
 
 async def update_theme(
@@ -398,22 +621,28 @@ async def update_theme(
 ):
     old_theme = await _theme_selector_change(current_user, subject_id, theme_id, db)
 
+    if theme.name != old_theme.name and await get_theme_by_name(subject_id, theme.name, db):
+        raise _fastapi.HTTPException(status_code=400, detail='This theme already exists')
+
     old_theme.name = theme.name
     old_theme.description = theme.description
 
-    db.commit()
-    db.refresh(old_theme)
+    await _run(db.commit())
+
+    invalidate_catalog()
+    pooled_tests.clear()
+    old_theme = await _theme_selector(subject_id, theme_id, db)
 
     return _schemas.Theme.from_orm(old_theme)
 
 
 # ---------------------------------QUESTIONS-FUNCTIONS-----------------------------
 async def get_question_by_text(theme_id: int, question_text: str, db: _orm.Session):
-    return db.query(_models.Question).filter_by(theme_id=theme_id, text=question_text).first()
+    return await _first(db, _sql.select(_models.Question).filter_by(theme_id=theme_id, text=question_text))
 
 
 async def _question_selector(question_id: int, db: _orm.Session):
-    question = db.query(_models.Question).filter_by(id=question_id).first()
+    question = await _first(db, _sql.select(_models.Question).options(*_loading.QUESTION).filter_by(id=question_id))
 
     if question is None:
         raise _fastapi.HTTPException(status_code=404, detail="Question does not exist")
@@ -432,20 +661,53 @@ async def create_question(theme_id: int, question: _schemas.QuestionCreate, db:
                                     theme_id=theme_id)
 
     db.add(question_orm)
-    db.commit()
-    db.refresh(question_orm)
+    await _run(db.flush())
+    await _index_signatures([(question_orm.id, question.text)], db)
+    await _run(db.commit())
 
-    return question_orm
+    return await _question_selector(question_orm.id, db)
 
 
 async def get_question(question_id: int, db: _orm.Session):
     return await _question_selector(question_id, db)
 
 
-async def get_questions(db: _orm.Session):
-    questions = db.query(_models.Question).all()
+async def get_questions(db: _orm.Session, cursor: int = None, limit: int = PAGE_SIZE, theme_id: int = None):
+    questions = _sql.select(_models.Question).options(*_loading.QUESTION)
+
+    if theme_id is not None:
+        questions = questions.filter_by(theme_id=theme_id)
 
-    return list(map(_schemas.Question.from_orm, questions))
+    return await _page(db, questions, _models.Question, _schemas.Question, cursor, limit)
+
+
+async def get_question_rows(db: _orm.Session, cursor: int = None, limit: int = PAGE_SIZE, theme_id: int = None):
+    """get_questions as plain dicts, read from one joined column query."""
+    questions = _sql.select(
+        _models.Question.id,
+        _models.Question.text,
+        _models.Question.max_mark,
+        _models.Theme.id.label('theme_id'),
+        _models.Theme.name.label('theme_name'),
+        _models.Theme.description.label('theme_description'),
+    ).outerjoin(_models.Question.theme)
+
+    if theme_id is not None:
+        questions = questions.filter(_models.Question.theme_id == theme_id)
+
+    rows, next_cursor = await _row_page(db, questions, _models.Question.id, cursor, limit)
+    items = [
+        {
+            'id': row.id,
+            'text': row.text,
+            'max_mark': row.max_mark,
+            'theme': None if row.theme_id is None else
+            {'id': row.theme_id, 'name': row.theme_name, 'description': row.theme_description},
+        }
+        for row in rows
+    ]
+
+    return {'items': items, 'next_cursor': next_cursor}
 
 
 async def update_question(
@@ -456,12 +718,21 @@ async def update_question(
 ):
     old_question = await _question_selector_change(current_user, question_id, db)
 
+    if old_question.text != question.text:
+        if await get_question_by_text(old_question.theme_id, question.text, db):
+            raise _fastapi.HTTPException(status_code=400, detail='Question already exists')
+
+        await _drop_signatures([question_id], db)
+        await _index_signatures([(question_id, question.text)], db)
+
     old_question.text = question.text
     old_question.max_mark = question.max_mark
     old_question.answer = question.answer
 
-    db.commit()
-    db.refresh(old_question)
+    await _run(db.commit())
+    old_question = await _question_selector(question_id, db)
+
+    _answer_keys.pop(question_id)
 
     return old_question
 
@@ -473,22 +744,181 @@ async def delete_question(
 ):
     question = await _question_selector_change(current_user, question_id, db)
 
-    db.delete(question)
-    db.commit()
+    await _drop_signatures([question_id], db)
+    await _run(db.execute(_sql.delete(_models.QuestionStats).filter_by(question_id=question_id)))
+    await _run(db.delete(question))
+    await _run(db.commit())
+
+    _questions_by_theme.remove(question.theme_id, question_id)
+    _question_weights.remove(question.theme_id, question_id)
+    pooled_tests.clear()
+    _answer_keys.pop(question_id)
+
+
+async def _new_questions(after_id: int, db: _orm.Session):
+    """(id, theme id) of the questions after ``after_id``, in id order: those added since the in-memory indexes
+    were last read, by this process, another worker, importing.py or db_startup.py.
+    """
+    rows = await _run(db.execute(
+        _sql.select(_models.Question.id, _models.Question.theme_id)
+        .filter(_models.Question.id > after_id).order_by(_models.Question.id)
+    ))
+
+    return rows.all()
+
+
+async def _load_question_index(db: _orm.Session):
+    _questions_by_theme.extend(await _new_questions(_questions_by_theme.max_id, db))
+
+
+async def _get_questions_by_ids(question_ids: List[int], db: _orm.Session, options=()):
+    questions = await _all(
+        db, _sql.select(_models.Question).options(*options).filter(_models.Question.id.in_(question_ids))
+    )
+    positions = {question_id: i for (i, question_id) in enumerate(question_ids)}
+
+    return sorted(questions, key=lambda question: positions[question.id])
+
+
+async def _sample_questions(themes: List[_models.Theme], amounts: List[int], sample, db: _orm.Session):
+    """The questions ``sample(theme id, amount)`` draws for every theme, loaded. When some were deleted by another
+    process, the in-memory indexes of their theme are brought in line with the database and it is drawn again,
+    so the test isn't short.
+    """
+    drawn = [sample(theme.id, amount) for theme, amount in zip(themes, amounts)]
+    questions = await _get_questions_by_ids([question_id for ids in drawn for question_id in ids], db)
+    found = {question.id for question in questions}
+
+    if all(found.issuperset(ids) for ids in drawn):
+        return questions
+
+    for i, ids in enumerate(drawn):
+        if not found.issuperset(ids):
+            theme_id = themes[i].id
+            existing = set(await _all(db, _sql.select(_models.Question.id).filter_by(theme_id=theme_id)))
+            _questions_by_theme.retain(theme_id, existing)
+            _question_weights.retain(theme_id, existing)
+            drawn[i] = sample(theme_id, amounts[i])
+
+    return await _get_questions_by_ids([question_id for ids in drawn for question_id in ids], db)
 
 
 async def get_random_questions_by_theme(theme: _models.Theme, amount: int, db: _orm.Session):
-    questions = db.query(_models.Question)\
-        .filter_by(theme_id=theme.id)\
-        .order_by(_random())\
-        .limit(amount)\
-        .all()
-    return questions
+    await _load_question_index(db)
+
+    return await _sample_questions([theme], [amount], _questions_by_theme.sample, db)
+
+
+async def search_questions(
+        query: str,
+        db: _orm.Session,
+        cursor: int = None,
+        limit: int = PAGE_SIZE,
+        theme_id: int = None
+):
+    """Questions matching every word of ``query`` as a prefix, best match first, out of the first
+    search.MAX_RANKED matches, and whether there were more; the cursor is an offset.
+    """
+    match = _search.match_query(query)
+
+    if match is None:
+        raise _fastapi.HTTPException(status_code=400, detail="Empty search query")
+
+    offset = cursor or 0
+    statement = _search.search_statement(theme_id)
+    parameters = dict(match=match, theme_id=theme_id, limit=limit + 1, offset=offset)
+    rows = (await _run(db.execute(statement, parameters))).all()
+
+    # a cursor past the last page gets no rows to read the flag from
+    flags = rows or offset and (await _run(db.execute(statement, dict(parameters, limit=1, offset=0)))).all()
+
+    next_cursor = offset + limit if len(rows) > limit else None
+    questions = await _get_questions_by_ids([row.id for row in rows[:limit]], db, _loading.QUESTION)
+
+    return _schemas.SearchPage(
+        items=list(map(_schemas.Question.from_orm, questions)), next_cursor=next_cursor,
+        truncated=bool(flags and flags[0].truncated)
+    )
+
+
+async def _index_signatures(questions, db: _orm.Session):
+    """Stores the near-duplicate signatures of (question id, text) pairs."""
+    signature_rows, band_rows = _duplicates.index_rows(questions)
+
+    if signature_rows:
+        await _run(db.execute(_models.question_signature_table.insert(), signature_rows))
+        await _run(db.execute(_models.question_band_table.insert(), band_rows))
+
+
+async def _load_signatures(question_ids: List[int], db: _orm.Session):
+    signatures = {}
+
+    for start in range(0, len(question_ids), _duplicates.BATCH_SIZE):
+        chunk = question_ids[start:start + _duplicates.BATCH_SIZE]
+        for question_id, value in await _run(db.execute(_duplicates.signatures_statement(chunk))):
+            signatures[question_id] = _duplicates.load_signature(value)
+
+    return signatures
+
+
+async def _drop_signatures(question_ids: List[int], db: _orm.Session):
+    for question_id, signature in (await _load_signatures(question_ids, db)).items():
+        for statement in _duplicates.delete_statements(question_id, signature):
+            await _run(db.execute(statement))
+
+
+async def find_duplicates(
+        text: str,
+        db: _orm.Session,
+        threshold: float = _duplicates.DEFAULT_THRESHOLD,
+        limit: int = _duplicates.MAX_CANDIDATES
+):
+    """Questions whose text is estimated at least ``threshold`` similar to ``text``, most similar first."""
+    signature = _duplicates.signature(text)
+
+    if signature is None:
+        raise _fastapi.HTTPException(status_code=400, detail="Question text has no words")
+
+    # questions sharing the most buckets are the likeliest duplicates
+    shared = _collections.Counter((await _run(db.execute(_duplicates.candidates_statement(signature)))).scalars())
+    candidates = [question_id for question_id, _ in shared.most_common(_duplicates.MAX_CANDIDATES)]
+
+    scores = {
+        question_id: _duplicates.similarity(signature, candidate)
+        for question_id, candidate in (await _load_signatures(candidates, db)).items()
+    }
+    question_ids = sorted(
+        (question_id for question_id, score in scores.items() if score >= threshold),
+        key=lambda question_id: (-scores[question_id], question_id)
+    )[:limit]
+    questions = await _get_questions_by_ids(question_ids, db, _loading.QUESTION)
+
+    return [
+        _schemas.DuplicateCandidate(question=_schemas.Question.from_orm(question), similarity=scores[question.id])
+        for question in questions
+    ]
+
+
+async def get_duplicate_clusters(db: _orm.Session, threshold: float = _duplicates.DEFAULT_THRESHOLD):
+    """Clusters of near-duplicate questions across the whole bank, from one pass over question_bands."""
+    scan = _duplicates.ClusterScan()
+    rows = (await _run(db.execute(_duplicates.bands_statement()))).all()
+
+    while rows:
+        scan.feed(rows)
+        rows = (await _run(db.execute(_duplicates.bands_statement(rows[-1])))).all()
+
+    signatures = await _load_signatures(scan.question_ids(), db)
+
+    return [
+        _schemas.DuplicateCluster(question_ids=question_ids)
+        for question_ids in _duplicates.clusters(scan.pairs, signatures, threshold)
+    ]
 
 
 # -------------------------------------ANSWER-FUNCTIONS-----------------------------
 async def answer_exists(test_id: int, question_id: int, db: _orm.Session):
-    answer = db.query(_models.Answer).filter_by(test_id=test_id, question_id=question_id).first()
+    answer = await _first(db, _sql.select(_models.Answer).filter_by(test_id=test_id, question_id=question_id))
     if answer is None:
         return False
 
@@ -496,28 +926,50 @@ async def answer_exists(test_id: int, question_id: int, db: _orm.Session):
 
 
 async def _answer_selector(test_id: int, question_id: int, db: _orm.Session):
-    return db.query(_models.Answer).filter_by(test_id=test_id, question_id=question_id).first()
+    return await _first(db, _sql.select(_models.Answer).filter_by(test_id=test_id, question_id=question_id))
 
 
-async def get_mark(question_id: int, answer: _schemas.AnswerCreate, db: _orm.Session):
-    question = db.query(_models.Question).filter_by(id=question_id).first()
+async def _test_user_id(test_id: int, db: _orm.Session):
+    """The id of the test's user, None for a test without one."""
+    test = (await _run(db.execute(_sql.select(_models.Test.user_id).filter_by(id=test_id)))).first()
 
-    if question.max_mark == 1:
-        if question.answer == answer.given_answer:
-            return 1
-        else:
-            return 0
+    if test is None:
+        raise _fastapi.HTTPException(status_code=404, detail="Test does no exist")
 
-    else:
-        answers = set(str(question.answer).split('; '))
-        given_answers = set(answer.given_answer.split('; '))
+    return test.user_id
+
+
+async def _get_answer_keys(question_ids: List[int], db: _orm.Session):
+    keys, missing = _answer_keys.get_many(question_ids)
+
+    if missing:
+        rows = await _run(db.execute(
+            _sql.select(
+                _models.Question.id, _models.Question.answer, _models.Question.max_mark, _models.Question.theme_id
+            )
+            .filter(_models.Question.id.in_(missing))
+        ))
+
+        for (question_id, answer, max_mark, theme_id) in rows:
+            keys[question_id] = _grading.AnswerKey(answer, max_mark, theme_id)
+            _answer_keys.set(question_id, keys[question_id])
+
+    return keys
 
-        if len(given_answers) > len(answers):
-            mark = len(answers) - len(given_answers)
-        else:
-            mark = 0
-        mark += len(answers.intersection(given_answers))
-        return max(0, mark)
+
+async def _answer_key(question_id: int, db: _orm.Session):
+    key = (await _get_answer_keys([question_id], db)).get(question_id)
+
+    if key is None:
+        raise _fastapi.HTTPException(status_code=404, detail="Question does not exist")
+
+    return key
+
+
+async def get_mark(question_id: int, answer: _schemas.AnswerCreate, db: _orm.Session):
+    key = await _answer_key(question_id, db)
+
+    return key.grade(answer.given_answer)
 
 
 async def create_answer(
@@ -526,12 +978,18 @@ async def create_answer(
         answer: _schemas.AnswerCreate,
         db: _orm.Session
 ):
-    mark = await get_mark(question_id, answer, db)
+    user_id = await _test_user_id(test_id, db)
+    key = await _answer_key(question_id, db)
+    mark = key.grade(answer.given_answer)
     answer_orm = _models.Answer(given_answer=answer.given_answer, mark=mark, question_id=question_id, test_id=test_id)
 
     db.add(answer_orm)
-    db.commit()
-    db.refresh(answer_orm)
+    await _record_attempts(user_id, {key.theme_id: (mark / key.max_mark, 1)}, db)
+    await _record_question_attempts({question_id: (mark / key.max_mark, 1)}, db)
+    await _run(db.commit())
+    await _run(db.refresh(answer_orm))
+
+    _question_weights.record(key.theme_id, question_id, mark / key.max_mark, 1)
 
     return _schemas.Answer.from_orm(answer_orm)
 
@@ -542,21 +1000,188 @@ async def update_answer(
         answer: _schemas.AnswerCreate,
         db: _orm.Session
 ):
-    mark = await get_mark(question_id, answer, db)
+    user_id = await _test_user_id(test_id, db)
+    key = await _answer_key(question_id, db)
+    mark = key.grade(answer.given_answer)
     old_answer = await _answer_selector(test_id, question_id, db)
 
+    mark_change = (mark - old_answer.mark) / key.max_mark
+    await _record_attempts(user_id, {key.theme_id: (mark_change, 0)}, db)
+    await _record_question_attempts({question_id: (mark_change, 0)}, db)
+
     old_answer.given_answer = answer.given_answer
     old_answer.mark = mark
 
-    db.commit()
-    db.refresh(old_answer)
+    await _run(db.commit())
+    await _run(db.refresh(old_answer))
+
+    _question_weights.record(key.theme_id, question_id, mark_change, 0)
 
     return _schemas.Answer.from_orm(old_answer)
 
 
+async def submit_answers(test_id: int, answers: List[_schemas.AnswerSubmit], db: _orm.Session, user: _schemas.User):
+    """Grades and stores all answers of a test in one transaction, updating the answers that already exist."""
+    test = await _test_selector(test_id, db, user, _loading.TEST_COMPLETED)
+
+    question_ids = {question.id for question in test.questions}
+
+    if any(answer.question_id not in question_ids for answer in answers):
+        raise _fastapi.HTTPException(status_code=404, detail="Question is not in this test")
+
+    keys = await _get_answer_keys([answer.question_id for answer in answers], db)
+    marks = _grading.grade_answers(keys, answers)
+
+    old_answers = {answer.question_id: answer for answer in test.answers}
+    theme_marks, question_marks = {}, {}
+    result = []
+
+    for (answer, mark) in zip(answers, marks):
+        key = keys[answer.question_id]
+        answer_orm = old_answers.get(answer.question_id)
+
+        if answer_orm is None:
+            answer_orm = _models.Answer(question_id=answer.question_id, test_id=test_id, mark=0)
+            old_answers[answer.question_id] = answer_orm
+            db.add(answer_orm)
+            attempts = 1
+        else:
+            attempts = 0
+
+        mark_sum, total = theme_marks.get(key.theme_id, (0, 0))
+        theme_marks[key.theme_id] = (mark_sum + (mark - answer_orm.mark) / key.max_mark, total + attempts)
+        mark_sum, total = question_marks.get(answer.question_id, (0, 0))
+        question_marks[answer.question_id] = (mark_sum + (mark - answer_orm.mark) / key.max_mark, total + attempts)
+
+        answer_orm.given_answer = answer.given_answer
+        answer_orm.mark = mark
+        result.append(answer_orm)
+
+    await _record_attempts(user.id, theme_marks, db)
+    await _record_question_attempts(question_marks, db)
+    await _run(db.flush())
+    result = list(map(_schemas.Answer.from_orm, result))
+    await _run(db.commit())
+
+    for question_id, (mark_sum, attempts) in question_marks.items():
+        _question_weights.record(keys[question_id].theme_id, question_id, mark_sum, attempts)
+
+    return result
+
+
+# -------------------------------------STATS-FUNCTIONS-----------------------------
+# dialects with INSERT ... ON CONFLICT DO UPDATE
+_UPSERT_DIALECTS = {'sqlite': _sqlite, 'postgresql': _postgresql}
+
+
+async def _upsert(table: _sql.Table, rows: List[dict], keys: List[str], added: List[str], db: _orm.Session):
+    """Inserts ``rows`` into ``table``. A row whose ``keys`` are taken instead adds its ``added`` columns to the
+    existing row and overwrites the rest. One INSERT ... ON CONFLICT where the dialect has it, an UPDATE and,
+    if it matched nothing, an INSERT per row elsewhere.
+    """
+    if not rows:
+        return
+
+    dialect = _UPSERT_DIALECTS.get(db.bind.dialect.name)
+
+    if dialect is not None:
+        statement = dialect.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c[key] for key in keys],
+            set_={
+                column: table.c[column] + statement.excluded[column] if column in added else statement.excluded[column]
+                for column in rows[0] if column not in keys
+            }
+        )
+        await _run(db.execute(statement, rows))
+        return
+
+    for row in rows:
+        updated = await _run(db.execute(
+            table.update()
+            .where(*(table.c[key] == row[key] for key in keys))
+            .values({
+                column: table.c[column] + value if column in added else value
+                for column, value in row.items() if column not in keys
+            })
+        ))
+
+        if not updated.rowcount:
+            await _run(db.execute(table.insert().values(row)))
+
+
+async def _record_attempts(user_id: int, theme_marks: dict, db: _orm.Session):
+    """Adds normalized marks and attempt counts, given as {theme_id: (mark_sum, attempts)},
+    to the user_theme_stats rows of the user. Answers to a test without a user, such as a deleted
+    user's, count for nobody.
+    """
+    if user_id is None:
+        return
+
+    now = _dt.datetime.utcnow()
+
+    rows = [
+        dict(user_id=user_id, theme_id=theme_id, mark_sum=mark_sum, attempts=attempts, last_attempt=now)
+        for (theme_id, (mark_sum, attempts)) in theme_marks.items()
+    ]
+
+    await _upsert(_models.UserThemeStats.__table__, rows, ['user_id', 'theme_id'], ['mark_sum', 'attempts'], db)
+
+
+async def _record_question_attempts(question_marks: dict, db: _orm.Session):
+    """Adds normalized marks and attempt counts, given as {question_id: (mark_sum, attempts)}, to question_stats."""
+    rows = [
+        dict(question_id=question_id, mark_sum=mark_sum, attempts=attempts)
+        for (question_id, (mark_sum, attempts)) in question_marks.items()
+    ]
+
+    await _upsert(_models.QuestionStats.__table__, rows, ['question_id'], ['mark_sum', 'attempts'], db)
+
+
+async def rebuild_theme_stats(db: _orm.Session):
+    """Recomputes user_theme_stats from all answers, for databases that have answers from before the table existed."""
+    stats = _models.UserThemeStats.__table__
+
+    totals = _sql.select(
+        _models.Test.user_id,
+        _models.Question.theme_id,
+        _sql.func.sum(_sql.cast(_models.Answer.mark, _sql.Float) / _models.Question.max_mark),
+        _sql.func.count(_models.Answer.id),
+        _sql.func.max(_models.Test.date),
+    )\
+        .select_from(_models.Answer)\
+        .join(_models.Test, _models.Answer.test_id == _models.Test.id)\
+        .join(_models.Question, _models.Answer.question_id == _models.Question.id)\
+        .filter(_models.Test.user_id.isnot(None), _models.Question.theme_id.isnot(None))\
+        .group_by(_models.Test.user_id, _models.Question.theme_id)
+
+    await _run(db.execute(_sql.delete(stats)))
+    await _run(db.execute(stats.insert().from_select(
+        ['user_id', 'theme_id', 'mark_sum', 'attempts', 'last_attempt'], totals
+    )))
+    await _run(db.commit())
+
+
+async def rebuild_question_stats(db: _orm.Session):
+    """Recomputes question_stats from all answers, for databases that have answers from before the table existed."""
+    stats = _models.QuestionStats.__table__
+
+    totals = _sql.select(
+        _models.Answer.question_id,
+        _sql.func.sum(_sql.cast(_models.Answer.mark, _sql.Float) / _models.Question.max_mark),
+        _sql.func.count(_models.Answer.id),
+    )\
+        .join(_models.Question, _models.Answer.question_id == _models.Question.id)\
+        .group_by(_models.Answer.question_id)
+
+    await _run(db.execute(_sql.delete(stats)))
+    await _run(db.execute(stats.insert().from_select(['question_id', 'mark_sum', 'attempts'], totals)))
+    await _run(db.commit())
+
+
 # --------------------------------------TEST-FUNCTIONS---------------------------------
-async def _test_selector(test_id: int, db: _orm.Session, user: _schemas.User):
-    test = db.query(_models.Test).filter_by(id=test_id, user_id=user.id).first()
+async def _test_selector(test_id: int, db: _orm.Session, user: _schemas.User, options=_loading.TEST):
+    test = await _first(db, _sql.select(_models.Test).options(*options).filter_by(id=test_id, user_id=user.id))
 
     if test is None:
         raise _fastapi.HTTPException(status_code=404, detail="Test does no exist")
@@ -565,15 +1190,78 @@ async def _test_selector(test_id: int, db: _orm.Session, user: _schemas.User):
 
 
 async def _get_test_themes(subject_id: int, theme_names: List[str], db: _orm.Session):
-    themes = []
-
-    for theme_name in theme_names:
-        themes.append(await get_theme_by_name(subject_id, theme_name, db))
-
-    return themes
+    themes = await _all(
+        db,
+        _sql.select(_models.Theme).filter(_models.Theme.subject_id == subject_id, _models.Theme.name.in_(theme_names))
+    )
+    themes = {theme.name: theme for theme in themes}
+
+    return [themes.get(theme_name) for theme_name in theme_names]
+
+
+async def _load_question_weights(db: _orm.Session):
+    if _question_weights.loaded:
+        _question_weights.extend(await _new_questions(_question_weights.max_id, db))
+        return
+
+    questions = await _new_questions(0, db)
+    stats = await _run(db.execute(_sql.select(
+        _models.QuestionStats.question_id, _models.QuestionStats.mark_sum, _models.QuestionStats.attempts
+    )))
+    _question_weights.load(questions, stats.all())
+
+
+async def _get_question_scores(user_id: int, theme_ids: List[int], db: _orm.Session):
+    """The user's average mark / max_mark per question they answered in the given themes."""
+    rows = await _run(db.execute(
+        _sql.select(
+            _models.Answer.question_id,
+            _sql.func.avg(_sql.cast(_models.Answer.mark, _sql.Float) / _models.Question.max_mark),
+        )
+        .join(_models.Test, _models.Answer.test_id == _models.Test.id)
+        .join(_models.Question, _models.Answer.question_id == _models.Question.id)
+        .filter(_models.Test.user_id == user_id, _models.Question.theme_id.in_(theme_ids))
+        .group_by(_models.Answer.question_id)
+    ))
+
+    return dict(rows.all())
+
+
+async def get_question_weights(subject_id: int, theme_id: int, db: _orm.Session, user_id: int = None):
+    """The weights adaptive tests draw the theme's questions with, for the given user if any."""
+    theme = await _theme_selector(subject_id, theme_id, db)
+
+    await _load_question_weights(db)
+    scores = {} if user_id is None else await _get_question_scores(user_id, [theme.id], db)
+    weights = _question_weights.weights(theme.id, scores)
+    total = sum(weight for (*_, weight) in weights)
+
+    return [
+        _schemas.QuestionWeight(
+            question_id=question_id, base_weight=base_weight, student_factor=factor, weight=weight,
+            probability=weight / total
+        )
+        for (question_id, base_weight, factor, weight) in weights
+    ]
+
+
+async def generate_test(
+        subject_id: int,
+        theme_names: List[str],
+        db: _orm.Session,
+        current_user: _schemas.User,
+        adaptive: bool = False
+):
+    """A test of 20 questions split evenly over the themes, drawn uniformly or, when ``adaptive``, weighted by
+    the questions' difficulty and the user's answers to them (see sampling.py). Uniform tests come from the
+    pool of ready-made tests when it has one (see test_pool.py).
+    """
+    if not adaptive:
+        test = await _claim_pooled_test(subject_id, theme_names, db, current_user)
 
+        if test is not None:
+            return test
 
-async def generate_test(subject_id: int, theme_names: List[str], db: _orm.Session, current_user: _schemas.User):
     themes = await _get_test_themes(subject_id, theme_names, db)
 
     if None in themes:
@@ -581,27 +1269,262 @@ async def generate_test(subject_id: int, theme_names: List[str], db: _orm.Sessio
 
     amounts = get_amounts(20, len(themes))
 
-    questions = []
-
-    for (i, j) in zip(themes, amounts):
-        questions.extend(await get_random_questions_by_theme(i, j, db))
+    if adaptive:
+        await _load_question_weights(db)
+        scores = await _get_question_scores(current_user.id, [theme.id for theme in themes], db)
+        questions = await _sample_questions(
+            themes, amounts, lambda theme_id, amount: _question_weights.sample(theme_id, amount, scores), db
+        )
+    else:
+        await _load_question_index(db)
+        questions = await _sample_questions(themes, amounts, _questions_by_theme.sample, db)
 
     test = _models.Test(date=_dt.datetime.utcnow(), user_id=current_user.id)
 
     test.questions = questions
 
     db.add(test)
-    db.commit()
-    db.refresh(test)
+    await _run(db.commit())
+
+    if not adaptive:
+        pooled_tests.want((subject_id, tuple(theme_names)))
+
+    return await _test_selector(test.id, db, current_user)
+
+
+async def _claim_pooled_test(subject_id: int, theme_names: List[str], db: _orm.Session, current_user: _schemas.User):
+    """A test from the pool, given to the user, or None if the pool is empty."""
+    tests = _models.Test.__table__
+    key = (subject_id, tuple(theme_names))
+    test_id = pooled_tests.take(key)
+
+    if test_id is None:
+        return None
+
+    claimed = await _run(db.execute(
+        tests.update()
+        .where(tests.c.id == test_id, tests.c.pool_owner == pooled_tests.owner)
+        .values(user_id=current_user.id, date=_dt.datetime.utcnow(), pool_owner=None)
+    ))
+    await _run(db.commit())
+
+    if not claimed.rowcount:
+        # deleted from under the pool, e.g. with the database, and most likely the rest of its tests with it
+        pooled_tests.drop(key)
+        return None
+
+    return await _test_selector(test_id, db, current_user)
 
-    return test
+
+async def _generate_pooled_tests(owner: str, key, amount: int, db: _orm.Session):
+    """Stores ``amount`` tests of the pool ``owner`` for a (subject id, theme names) key and returns their ids."""
+    subject_id, theme_names = key
+    themes = await _get_test_themes(subject_id, list(theme_names), db)
+
+    if None in themes:
+        return []
+
+    await _load_question_index(db)
+    amounts = get_amounts(20, len(themes))
+    tests = _models.Test.__table__
+    test_ids, rows = [], []
+
+    for _ in range(amount):
+        result = await _run(db.execute(tests.insert().values(date=_dt.datetime.utcnow(), pool_owner=owner)))
+        test_ids.append(result.inserted_primary_key[0])
+        questions = await _sample_questions(themes, amounts, _questions_by_theme.sample, db)
+
+        rows.extend({'test_id': test_ids[-1], 'question_id': question.id} for question in questions)
+
+    if rows:
+        await _run(db.execute(_models.test_question_association_table.insert(), rows))
+
+    await _run(db.commit())
+
+    return test_ids
+
+
+async def _discard_pooled_tests(owner: str, test_ids: List[int], db: _orm.Session):
+    """Deletes the tests of the pool ``owner`` among ``test_ids`` that nobody claimed."""
+    tests, test_questions = _models.Test.__table__, _models.test_question_association_table
+    unclaimed = _sql.select(tests.c.id).where(tests.c.id.in_(test_ids), tests.c.pool_owner == owner)\
+        .scalar_subquery()
+
+    await _run(db.execute(test_questions.delete().where(test_questions.c.test_id.in_(unclaimed))))
+    await _run(db.execute(tests.delete().where(tests.c.id.in_(unclaimed))))
+    await _run(db.commit())
+
+
+def _in_pool_session(function):
+    """Runs a coroutine function of (*args, db) on a session of its own, from the pool's refill thread."""
+    def run(*args):
+        db = _database.SessionLocal()
+        try:
+            return _asyncio.run(function(*args, db))
+        finally:
+            db.close()
+
+    return run
+
+
+# ready-made tests by (subject id, theme names); see test_pool.py
+pooled_tests = _test_pool.TestPool(
+    _in_pool_session(_generate_pooled_tests), _in_pool_session(_discard_pooled_tests)
+)
 
 
 async def get_test(test_id: int, db: _orm.Session, current_user: _schemas.User):
     return await _test_selector(test_id, db, current_user)
 
 
-async def get_test_answers(db: _orm.Session, current_user: _schemas.User):
-    tests = db.query(_models.Test).filter_by(user_id=current_user.id).all()
+async def get_test_answers(db: _orm.Session, current_user: _schemas.User, cursor: int = None, limit: int = PAGE_SIZE):
+    tests = _sql.select(_models.Test).options(*_loading.TEST_COMPLETED).filter_by(user_id=current_user.id)
+
+    return await _page(db, tests, _models.Test, _schemas.TestCompleted, cursor, limit)
+
+
+# --------------------------------------EXPORT-FUNCTIONS---------------------------------
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORTS = {
+    'questions': (_models.Question, ['id', 'theme_id', 'text', 'answer', 'max_mark']),
+    'tests': (_models.Test, ['id', 'user_id', 'date']),
+    'answers': (_models.Answer, ['id', 'test_id', 'question_id', 'given_answer', 'mark']),
+}
+
+
+async def _export_chunks(table: str, db: _orm.Session, chunk_size: int):
+    """Yields the rows of an exported table in id order, ``chunk_size`` rows per query."""
+    model, columns = EXPORTS[table]
+    statement = _sql.select(*(getattr(model, column) for column in columns)).order_by(model.id).limit(chunk_size)
+    last_id = None
+
+    while True:
+        chunk = statement if last_id is None else statement.filter(model.id > last_id)
+        rows = (await _run(db.execute(chunk))).all()
+
+        if not rows:
+            return
+
+        yield rows
+        last_id = rows[-1].id
+
+
+async def export_ndjson(table: str, db: _orm.Session, chunk_size: int = EXPORT_CHUNK_SIZE):
+    async for rows in _export_chunks(table, db, chunk_size):
+        yield ''.join(_json.dumps(dict(row._mapping), default=str, ensure_ascii=False) + '\n' for row in rows)
+
+
+async def export_csv(table: str, db: _orm.Session, chunk_size: int = EXPORT_CHUNK_SIZE):
+    buffer = _io.StringIO()
+    writer = _csv.writer(buffer)
+    writer.writerow(EXPORTS[table][1])
+
+    async for rows in _export_chunks(table, db, chunk_size):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# --------------------------------------IMPORT-FUNCTIONS---------------------------------
+async def _import_themes(db: _orm.Session):
+    """Theme ids by (subject name, theme name), read once per import."""
+    rows = await _run(db.execute(
+        _sql.select(_models.Theme.id, _models.Theme.name, _models.Subject.name.label('subject'))
+        .outerjoin(_models.Theme.subject)
+    ))
+
+    return {(row.subject, row.name): row.id for row in rows}
+
+
+async def _question_ids(texts_by_theme: dict, db: _orm.Session):
+    """Ids of the questions with the given texts by theme id, by (theme id, text)."""
+    ids = {}
+
+    for theme_id, texts in texts_by_theme.items():
+        rows = await _run(db.execute(
+            _sql.select(_models.Question.id, _models.Question.text)
+            .filter(_models.Question.theme_id == theme_id, _models.Question.text.in_(texts))
+        ))
+        ids.update(((theme_id, row.text), row.id) for row in rows)
+
+    return ids
+
+
+def _texts_by_theme(questions):
+    texts = {}
+
+    for _, theme_id, question in questions:
+        texts.setdefault(theme_id, []).append(question.text)
+
+    return texts
+
+
+async def _import_batch(batch: list, errors: list, db: _orm.Session):
+    """Inserts a batch of (line, theme id, question) in one transaction, skipping questions already in the bank."""
+    existing = await _question_ids(_texts_by_theme(batch), db)
+    questions = []
+
+    for line, theme_id, question in batch:
+        if (theme_id, question.text) in existing:
+            errors.append(_schemas.ImportRowError(line=line, error='Question already exists'))
+        else:
+            questions.append((line, theme_id, question))
+
+    if not questions:
+        return 0
+
+    await _run(db.execute(_models.Question.__table__.insert(), [
+        {'text': question.text, 'answer': question.answer, 'max_mark': question.max_mark, 'theme_id': theme_id}
+        for _, theme_id, question in questions
+    ]))
+    ids = await _question_ids(_texts_by_theme(questions), db)
+    await _index_signatures([(ids[theme_id, question.text], question.text) for _, theme_id, question in questions], db)
+    await _run(db.commit())
+
+    return len(questions)
+
+
+async def import_questions(file, format: str, db: _orm.Session):
+    """Imports the questions of a CSV or JSON Lines text file; see importing.py for the row format."""
+    themes = await _import_themes(db)
+    theme_ids = set(themes.values())
+    first_lines = {}
+    errors, batch = [], []
+    imported = 0
+
+    for line, row in _importing.read_rows(file, format):
+        question = row if isinstance(row, str) else _importing.parse(row)
+
+        if isinstance(question, str):
+            errors.append(_schemas.ImportRowError(line=line, error=question))
+            continue
+
+        if question.theme_id is None:
+            theme_id = themes.get((question.subject, question.theme))
+        else:
+            theme_id = question.theme_id if question.theme_id in theme_ids else None
+
+        if theme_id is None:
+            errors.append(_schemas.ImportRowError(line=line, error='Theme does not exist'))
+            continue
+
+        first_line = first_lines.setdefault((theme_id, question.text), line)
+        if first_line != line:
+            errors.append(_schemas.ImportRowError(line=line, error=f'Same question as line {first_line}'))
+            continue
+
+        batch.append((line, theme_id, question))
+
+        if len(batch) >= _importing.BATCH_SIZE:
+            imported += await _import_batch(batch, errors, db)
+            batch = []
+
+    if batch:
+        imported += await _import_batch(batch, errors, db)
+
+    errors.sort(key=lambda error: error.line)
 
-    return tests
+    return _schemas.ImportReport(imported=imported, errors=errors)
@@ -0,0 +1,192 @@
+"""Tests generated ahead of time, so starting a test doesn't pick questions and write them under load.
+
+For every (subject id, theme names) a test was generated for, TestPool keeps up to TEST_POOL_SIZE tests
+stored without a user and marked with the pool's owner id, random for every process. take() hands each of
+them to a single caller; the services then claim it for the user with one conditional UPDATE and load it by
+id, which costs the same whatever the size of the bank.
+A background thread refills the pools, TEST_POOL_BATCH tests per transaction, so the inserts happen outside
+of the requests. A pool that fell below the low-water mark is refilled while tests are being taken, at most
+one batch per TEST_POOL_REFILL_INTERVAL seconds so the refills only get a share of the database; above it
+the pool is topped up once no test was taken for TEST_POOL_REFILL_DELAY seconds. Pools are dropped, and
+their unclaimed tests deleted, when the questions or themes they were drawn from change. With several
+workers every worker keeps its own pools and only ever deletes the tests it generated; those of a worker
+that didn't stop cleanly stay behind unused. Set TEST_POOL_SIZE=0 to generate every test on request.
+"""
+import collections as _collections
+import os as _os
+import secrets as _secrets
+import threading as _threading
+import time as _time
+
+# enough for a class starting its test at once
+TEST_POOL_SIZE = int(_os.environ.get("TEST_POOL_SIZE", 100))
+TEST_POOL_BATCH = 10
+# share of TEST_POOL_SIZE below which pools are refilled even while tests are being taken
+TEST_POOL_LOW_WATER = 0.5
+# seconds between two refill batches while tests are being taken
+TEST_POOL_REFILL_INTERVAL = 0.2
+# seconds without a test taken before pools above the low-water mark are topped up
+TEST_POOL_REFILL_DELAY = 1
+# pools of the least recently used theme sets are dropped beyond this many
+MAX_POOLS = 256
+
+
+class TestPool:
+    """``fill(owner, key, amount)`` stores up to ``amount`` new tests of ``owner`` for a key and returns their
+    ids, ``discard(owner, ids)`` deletes the tests of ``owner`` among ``ids`` nobody claimed. Both run in the
+    refill thread.
+    """
+
+    def __init__(self, fill, discard, size: int = TEST_POOL_SIZE, maxpools: int = MAX_POOLS):
+        self.size = size
+        self.low_water = max(1, int(size * TEST_POOL_LOW_WATER))
+        self.maxpools = maxpools
+        self._fill = fill
+        self._discard = discard
+        self._pools = _collections.OrderedDict()
+        self._generation = 0
+        self._discarded = []
+        self._wanted = _collections.OrderedDict()
+        self._lock = _threading.Lock()
+        self._changed = _threading.Condition(self._lock)
+        self._stopped = False
+        self._thread = None
+        # set when the thread starts, so processes forked from one that imported the pool differ
+        self.owner = None
+        self._last_take = float('-inf')
+        self._last_fill = float('-inf')
+
+    def take(self, key):
+        """The id of a pooled test for ``key`` that no other caller gets, or None if there is none."""
+        with self._lock:
+            pool = self._pools.get(key)
+
+            if not pool:
+                return None
+
+            self._pools.move_to_end(key)
+            test_id = pool.popleft()
+            self._last_take = _time.monotonic()
+            self._request(key)
+
+        return test_id
+
+    def want(self, key):
+        """Starts keeping a pool for ``key``, after a test was generated for it on request."""
+        if self.size <= 0:
+            return
+
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = _collections.deque()
+
+                if len(self._pools) > self.maxpools:
+                    evicted_key, evicted = self._pools.popitem(last=False)
+                    self._wanted.pop(evicted_key, None)
+                    self._discarded.extend(evicted)
+
+            self._request(key)
+
+    def drop(self, key):
+        """Drops the pool of ``key``, whose tests turned out to be gone, e.g. deleted with the database."""
+        with self._lock:
+            self._discarded.extend(self._pools.pop(key, ()))
+            self._wanted.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._drop_pools()
+
+    def _drop_pools(self):
+        for pool in self._pools.values():
+            self._discarded.extend(pool)
+
+        self._pools.clear()
+        self._wanted.clear()
+        self._generation += 1
+        self._changed.notify()
+
+    def _request(self, key):
+        if len(self._pools[key]) < self.size:
+            self._wanted[key] = None
+            self._changed.notify()
+
+    def _next_refill(self):
+        """The pool to refill next and the seconds until it may be, or (None, None) if no pool is wanted."""
+        if not self._wanted:
+            return None, None
+
+        idle_at = self._last_take + TEST_POOL_REFILL_DELAY
+
+        for key in self._wanted:
+            if len(self._pools[key]) < self.low_water:
+                return key, min(idle_at, self._last_fill + TEST_POOL_REFILL_INTERVAL) - _time.monotonic()
+
+        return next(iter(self._wanted)), idle_at - _time.monotonic()
+
+    def _next_job(self):
+        with self._lock:
+            while not (self._stopped or self._discarded):
+                key, wait = self._next_refill()
+
+                if key is not None and wait <= 0:
+                    break
+
+                self._changed.wait(wait)
+
+            discarded, self._discarded = self._discarded, []
+            key, wait = self._next_refill()
+            amount = 0
+
+            if key is not None and wait <= 0:
+                del self._wanted[key]
+                amount = min(TEST_POOL_BATCH, self.size - len(self._pools[key]))
+                self._last_fill = _time.monotonic()
+
+            return discarded, key, amount, self._generation, self._stopped
+
+    def _run(self):
+        while True:
+            discarded, key, amount, generation, stopped = self._next_job()
+
+            try:
+                if discarded:
+                    self._discard(self.owner, discarded)
+
+                if stopped:
+                    return
+
+                if amount > 0:
+                    test_ids = self._fill(self.owner, key, amount)
+
+                    with self._lock:
+                        pool = self._pools.get(key)
+
+                        # the pool was dropped while these tests were generated from what changed
+                        if pool is None or generation != self._generation:
+                            self._discarded.extend(test_ids)
+                        else:
+                            pool.extend(test_ids)
+                            if test_ids:
+                                self._request(key)
+            except Exception as error:
+                print(f'Refilling the test pool failed: {error!r}')
+
+    def start(self):
+        if self.size > 0 and self._thread is None:
+            self._stopped = False
+            self.owner = _secrets.token_hex(8)
+            self._thread = _threading.Thread(target=self._run, name="test-pool", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Deletes the tests nobody claimed and stops the refill thread."""
+        if self._thread is None:
+            return
+
+        with self._lock:
+            self._drop_pools()
+            self._stopped = True
+
+        self._thread.join()
+        self._thread = None
@@ -19,7 +19,7 @@ const Subjects = () => {
             alert('Что-то пошло не так')
         } else {
         const data = await response.json();
-        setSubjects(data);
+        setSubjects(data.items);
         setLoaded(true);
         }
     };